@@ -4,30 +4,53 @@ import shutil
 import pandas as pd 
 import numpy as np
 import re
+import io
 from cyclic_temperature_dependent import TemperatureFileProcessor
+from metrics import label, timed
+from parsed_file import ParsedFile, normalize_file_format, parsed_file_cache
+from sniffer import sniff_frame, sniff_text
+from table_reader import COLUMNAR_FILE_FORMATS, read_numeric_table
+from serializers import iter_records
 
 class data_file:
     keywords = ["R1","R2","R3","R","Resistance"]
     relative_error_percent = 10
     min_required_rows_percent = 80
     temperature_range = range(-50, 300)
+    sniff_prefix_bytes = 4 * 1024 * 1024
     
-    def __init__(self, file_path):
+    def __init__(self, file_path, file_format=None, name=None):
+        """
+        file_path: the path of the file, or the content of the file as bytes, memoryview or binary file-like object.
+        file_format: the extension of the file (".csv", ".txt", ".xlsx", ".parquet", ".arrow", ".npy"). It is required if the content is given
+        directly, for a path it replaces the extension of the path.
+        name: the file name of content that is given directly, e.g. "folder_RT/file.csv" used by file_temperature.
+        """
+        self.parsed_file = ParsedFile(file_path)
+        if self.parsed_file.in_memory:
+            if file_format is None:
+                raise ValueError("file_format is required if the content of the file is given directly")
+            file_path = name if name is not None else ''
         self.file_path = file_path
         self.file_name = os.path.splitext(file_path)[0]
-        self.file_extention = os.path.splitext(file_path)[1]
+        self.file_extention = normalize_file_format(file_format) if file_format else os.path.splitext(file_path)[1]
         self.base_name = os.path.basename(self.file_name)
-        self.dir_name = os.path.dirname(os.path.realpath(self.file_path))
+        if self.parsed_file.in_memory:
+            self.dir_name = os.path.dirname(self.file_path)
+        else:
+            self.dir_name = os.path.dirname(os.path.realpath(self.file_path))
         self.base_name_dir = os.path.basename(self.dir_name)
         self.encoding_read_file = "ISO-8859-1"
         self.encoding_pd_read_csv = 'unicode_escape'
         self.encoding_open_file = 'utf8'
-        self.cyclic_temp_processor = TemperatureFileProcessor(file_path)
+        self.cyclic_temp_processor = TemperatureFileProcessor(self.file_path, self.file_extention, parsed_file=self.parsed_file)
         
         
 
             
     
+    @timed("sniff")
+    @parsed_file_cache
     def find_type_and_keyword(self):
         """
         Goal: finding keywords and data type of each word(column) in a file.
@@ -35,107 +58,29 @@ class data_file:
         1- How many keywords was found in the file--> key = keyword,  value = number of keywords
         2- The number of lines that have similar number of columns which are floatable
         key = number of floatable columns, value: number of lines
+        For csv and txt files only the first sniff_prefix_bytes of the file are read,
+        that is enough for finding the first 100 lines of the measurement table.
         """
-        file_path = self.file_path
         file_extention = self.file_extention
-        count_col_no = 0
-        count_l = 0
-        float_list =[]
         same_col_dict = {}
-        count_keyword = 0
-        #file_path, file_extention =self.final_file_path()
-        count_valid_data_file = 0
         if file_extention == '.csv' or file_extention == '.txt':
-            with open(file_path, 'r',encoding = self.encoding_read_file) as f:
-                
-                for line in f:
-                    count_fl =0
-                    count_str= 0
-                    count_l += 1
-
-                    for word in data_file.keywords:
-                        if word in line: 
-                            count_keyword +=1
-                            #print(line)
-                            #break
-
-
-                    if file_extention == ".csv":
-                        col = line.split(",")
-                    else:
-                        col = line.split()
-
-                    if len(col)>0:
-                        for c in col:
-                            c = c.replace(',','.')
-                            try:
-                                float(c)
-                                count_fl +=1
-                            except ValueError:
-                                count_str +=1
-                        if count_fl > 1:
-                            float_list.append(count_fl)
-                            if len(float_list)> 100:
-                                break
-
-                same_col_dict["keyword"] = count_keyword
-                # same_list is useful for not counting a value in float list more than 1 time.
-                same_list = []
-                for i in float_list:
-                #              keys= the number of columns with float type, 
-                #              value = how many times this kind of columns are repeated
-                    if float_list.count(i) > 5 and i not in same_list: 
-                        val_fl = i
-                        count_val_float = float_list.count(i)
-                        same_list.append(i)
-                        same_col_dict[val_fl] = count_val_float
+            text = self.parsed_file.text_prefix(self.encoding_read_file, data_file.sniff_prefix_bytes)
+            delimiter = "," if file_extention == ".csv" else None
+            same_col_dict = sniff_text(text, delimiter, data_file.keywords)
                         
         if file_extention == '.xlsx':
-            df = pd.read_excel(file_path)
-            ### opening .xlsx file by pandas returns empty values by NaN that is not known by fastAPI
-            ### to avoid this using following line NaN will be converted to None that is known by python and fastAPI
-            df = df.where(pd.notnull(df), None)
-            print(range(len(df.columns)))
-            for index, row in df.iterrows():
-                count_str = 0
-                count_fl = 0
-                row_values = row.tolist()
-               # print(type(row))
-                for value in row_values:
-                    if pd.notna(value): 
-                        try:
-                            float(value)
-                            count_fl +=1
-                        except ValueError:
-                            count_str +=1
-            ### with the following condition if the number of floats values in a column is at least two, it will be saved in float_list
-                if count_fl > 1:
-                    float_list.append(count_fl)
-                    if len(float_list)> 100:
-                        break
-                        
-            for word in data_file.keywords:
-                if word in df.columns:
-                    count_keyword +=1
-                for j in range(len(df.index)):
-                    list_rows= list(df.iloc[j][0:len(df.columns)])
-                    if word in list_rows:
-                        count_keyword +=1
-             
-            same_col_dict["keyword"] = count_keyword
-            same_list = []
-            for i in float_list:
-            #              keys= the number of columns with float type, 
-            #              value = how many times this kind of columns are repeated
-                if float_list.count(i) > 5 and i not in same_list: 
-                    val_fl = i
-                    count_val_float = float_list.count(i)
-                    same_list.append(i)
-                    same_col_dict[val_fl] = count_val_float
+            ### the sheet is loaded once with typed columns, floatable cells and keywords are counted column-wise
+            same_col_dict = sniff_frame(self.parsed_file.read_excel(), data_file.keywords)
+
+        if file_extention in COLUMNAR_FILE_FORMATS:
+            ### Parquet, Arrow and .npy files are loaded with typed columns, the column names are checked for keywords
+            same_col_dict = sniff_frame(self.parsed_file.read_columnar(file_extention), data_file.keywords)
             
         return same_col_dict
     
     
+    @timed("columns")
+    @parsed_file_cache
     def create_column_name(self):
         """
         The purpose of this function is to create column_name for txt file which contain table of measurement
@@ -160,24 +105,14 @@ class data_file:
                 #column_name = ['x','y','R','I','V','unknown_1','unknown_2']
                 
             if len(column_name) > 0:
-                df = pd.DataFrame(columns= column_name)
-                count_l = 0
-                f = open(file_path, encoding=self.encoding_open_file)
-                for line in f:
-                    if file_extention == ".csv":
-                        col = line.split(",")
-                    else:
-                        col = line.split()
-                    if len(col)>1:
-                        count_l +=1
-                        df.loc[count_l] = col
-               
-                for col_n in df.columns:
-                    df[col_n] = df[col_n].apply(lambda x: x.replace(',','.'))
+                delimiter = "," if file_extention == ".csv" else None
                 
-            ## The data of created dataframe in the above way are string so we need to make the float if possible for further evaluations!
+            ## The table is read with numeric columns, if any value is not floatable the column name can not be created
                 try: 
-                    df= df.apply(pd.to_numeric)
+                    if file_extention in COLUMNAR_FILE_FORMATS:
+                        df = self.columnar_table(column_name)
+                    else:
+                        df = read_numeric_table(self.parsed_file.text(self.encoding_open_file), column_name, delimiter)
                     if 'unknown_1' in column_name:
                         all_in_range_T = df['unknown_1'].apply(lambda x: x in data_file.temperature_range)
                         if all_in_range_T.all():
@@ -229,6 +164,7 @@ class data_file:
                 
         return created_column_name
   
+    @timed("validation")
     def file_validation(self):
     
         
@@ -315,19 +251,20 @@ class data_file:
         file_extention = self.file_extention
         T_list= [0,0,0,0]
         T_list[0]= file_path
-        with open(file_path, 'r',encoding = self.encoding_read_file) as f:
-            name_elements = self.base_name.split('_')
-            dir_elements = self.base_name_dir.split('_')
-            if "RT" in name_elements or "RT" in dir_elements:
-                T_list[1]=1   
-            elif "MA" in name_elements:
-                T_list[2]=1 
-            else:
-                T_list[3]=1
+        name_elements = self.base_name.split('_')
+        dir_elements = self.base_name_dir.split('_')
+        if "RT" in name_elements or "RT" in dir_elements:
+            T_list[1]=1   
+        elif "MA" in name_elements:
+            T_list[2]=1 
+        else:
+            T_list[3]=1
         # List_el shows that each element of T list is related to what. 1 means yes, 0 means No.     
         list_el=["File_Path", "RT", "Temperature_dependent", "Unknown_T"]
         return list_el, T_list       
 
+    @timed("columns")
+    @parsed_file_cache
     def find_skiprows(self):
         """
         Finding skiprows is important for generating a dataframe from a file(csv, txt ,...)
@@ -342,7 +279,7 @@ class data_file:
         count_w = 0
         if file_extention == '.csv' or file_extention == '.txt':
             
-            with open(file_path, 'r',encoding = self.encoding_read_file) as f:
+            with io.StringIO(self.parsed_file.text(self.encoding_read_file)) as f:
                 for line in f:
                     col =line.split(",")
                     for i,n in enumerate(col):
@@ -372,10 +309,18 @@ class data_file:
         if file_extention == '.xlsx':
             skip_list = []
             col_name = []
+
+        ## The column names of a columnar file are its header, a table without column names (.npy) has none
+        if file_extention in COLUMNAR_FILE_FORMATS:
+            skip_list = []
+            columns = list(self.parsed_file.read_columnar(file_extention).columns)
+            col_name = columns if all(isinstance(name, str) for name in columns) else []
             
         return skip_list, col_name
     
                 
+    @timed("columns")
+    @parsed_file_cache
     def find_column_name(self):
         """
         The column name is defined based on the the column name in the row which contain keywords. 
@@ -388,6 +333,8 @@ class data_file:
         #file_path, file_extention = self.final_file_path()
         same_dict = self.find_type_and_keyword()
         skip_list, col_name = self.find_skiprows()
+        ## the names are changed below, the list of find_skiprows() is kept as it is
+        col_name = list(col_name)
         print('Skip list and col name',skip_list, col_name)
         diff = list(same_dict.keys())[1]-len(col_name)
         print(list(same_dict.keys())[1])
@@ -395,7 +342,7 @@ class data_file:
         if diff == 0:
             column_name = col_name
         elif diff == 343 and file_extention == '.xlsx':
-            df = pd.read_excel(file_path)
+            df = self.parsed_file.read_excel()
             column_name = list(df.columns)
         else:
             for i in range(diff):
@@ -421,8 +368,59 @@ class data_file:
 
         return column_name
     
+    @timed("columns")
+    @parsed_file_cache
+    def resolve_column_name(self):
+        """
+        The column names which are used for generating the dataframe of the file:
+        the created column name for files without keywords and the found column name for files with keywords.
+        An empty list is returned if the file is not valid.
+        """
+        same_dict = self.find_type_and_keyword()
+        created_column_name = self.create_column_name()
+        if len(same_dict)>1 and same_dict["keyword"] == 0 and len(created_column_name)>0 :
+            return created_column_name
+        elif len(same_dict)>1 and same_dict["keyword"] > 0:
+            return self.find_column_name()
+        return []
     
+    @timed("dataframe")
+    @parsed_file_cache
+    def load_dataframe(self):
+        """
+        The dataframe of the measurement table with the resolved column names, before any further evaluation.
+        """
+        file_path = self.file_path
+        file_extention = self.file_extention
+        skip_list, col_name = self.find_skiprows()
+        column_name = self.resolve_column_name()
+        if len(column_name) == 0:
+            raise ValueError('file is not valid')
+        if file_extention == ".csv":
+            df=pd.read_csv(self.parsed_file.bytes_io(),names=column_name,skiprows= skip_list,encoding= self.encoding_pd_read_csv)
+        elif file_extention in COLUMNAR_FILE_FORMATS:
+            df = self.columnar_table(column_name)
+        else:
+            # TableParseError reports the rows which are not floatable
+            df = read_numeric_table(self.parsed_file.text(self.encoding_open_file), column_name)
+        label(rows=len(df))
+        return df
+
+    def columnar_table(self, column_name):
+        """
+        The table of a Parquet, Arrow or .npy file with column_name as column names, it is loaded
+        without a text parse and keeps the dtypes of the file.
+        """
+        df = self.parsed_file.read_columnar(self.file_extention)
+        if len(column_name) != df.shape[1]:
+            raise ValueError(f"Expected {df.shape[1]} column names, got {len(column_name)}")
+        ## the table of the parsed file is shared, the callers rename and add columns on their own copy
+        df = df.copy()
+        df.columns = column_name
+        return df
     
+    @timed("columns")
+    @parsed_file_cache
     def file_devision(self):
         """
         This function devides file based on the columns names in 5 categories:
@@ -435,13 +433,8 @@ class data_file:
         file_path = self.file_path
         file_extention = self.file_extention
         #file_path, file_extention = self.final_file_path()
-        same_dict = self.find_type_and_keyword()
-        created_column_name = self.create_column_name()
-        if len(same_dict)>1 and same_dict["keyword"] == 0 and len(created_column_name)>0 :
-            column_name = created_column_name
-        elif len(same_dict)>1 and same_dict["keyword"] > 0:
-            column_name = self.find_column_name()
-        else:
+        column_name = self.resolve_column_name()
+        if len(column_name) == 0:
             raise ValueError('File is not valid')
             
         name_elements = self.base_name.split('_')
@@ -469,6 +462,13 @@ class data_file:
             measurement_type[4] = 1
         else:
             measurement_type[5] = 1
+        ##### the type of the file for the timings of the request (metrics)
+        if measurement_type[1] or measurement_type[3]:
+            label(file_type="T_dependent")
+        elif measurement_type[2] or measurement_type[4]:
+            label(file_type="RT")
+        else:
+            label(file_type="other")
             
         df_measurment_type = pd.DataFrame(columns=measurement_type_header)
         df_measurment_type.loc[0]= measurement_type
@@ -476,6 +476,8 @@ class data_file:
     
 ########  finding max and min of resistance in each measurment Area
         
+    @timed("aggregation")
+    @parsed_file_cache
     def find_min_max_resistance_in_MA(self):
         """
             In this function two dataframe will be generated:
@@ -485,42 +487,17 @@ class data_file:
             in addition to mean and median , df_MA also shows R_min and R_max for database.
         """
         #file_path, file_extention = self.final_file_path()
-        file_path = self.file_path
-        file_extention = self.file_extention
         df_measurment_type = self.file_devision()
-        skip_list, col_name = self.find_skiprows()
-        same_dict = self.find_type_and_keyword()
-        created_column_name = self.create_column_name()
-        if len(same_dict)>1 and same_dict["keyword"] == 0 and len(created_column_name)>0 :
-            column_name = created_column_name
-        elif len(same_dict)>1 and same_dict["keyword"] > 0:
-            column_name = self.find_column_name()
-        else:
-            raise ValueError('file is not valid') 
-        data_ana = {} 
-        if file_extention == ".csv":
-            df=pd.read_csv(file_path,names=column_name,skiprows= skip_list,encoding= self.encoding_pd_read_csv)
-        else:
-            df = pd.DataFrame(columns= column_name)
-            count_l = 0
-            f = open(file_path, encoding=self.encoding_open_file)
-            for line in f:
-                col = line.split()
-                if len(col)>1:
-                    count_l +=1
-                    df.loc[count_l] = col
-            for col_n in df.columns:
-                df[col_n] = df[col_n].apply(lambda x: x.replace(',', '.'))
-                
-            try: 
-                df= df.apply(pd.to_numeric)
-            except ValueError:
-                print(file_path,': contains non floatable columns')
+        column_name = self.resolve_column_name()
+        df = self.load_dataframe()
                 
         if 'MA' in column_name:
             df = df.sort_values(['MA'], ascending=[True])
         elif 'x' and 'y' in column_name: 
             df = df.sort_values(['y', 'x'], ascending=[True, True])
+        else:
+            ## R_ave and R are added to a copy, the dataframe of load_dataframe() is shared
+            df = df.copy()
         
         if df_measurment_type["type_R1_R2_R3"].iloc[0] == 1:
             # finding negative measurements! Why should we?  I ignored this part to not lose any of 342 coordinates. as this is one of the measure of validity. 
@@ -622,57 +599,53 @@ class data_file:
         
         return df_coords
      
+    @timed("serialization")
     def table_of_df(self):
         """
-            In this function a dataframe generated by find_min_max_resistance_in_MA() will be read row by row 
-            then the value of each cell of a row will be associated to its corresponding column name in a dictionary. 
-            There for each row will have a dictionary. 
+            In this function a dataframe generated by find_min_max_resistance_in_MA() will be converted column-wise 
+            to normal Python values, then the value of each cell of a row will be associated to its corresponding column name in a dictionary. 
+            There for each row will have a dictionary, missing values are None. 
             All the dictionaries will be appended to a list (data_table). at the the jason file of DataTable will be returned. 
         """
        
+        data_table = list(self.iter_table_of_df())
+        
+        return {
+                "DataTable":data_table
+                }      
+
+    def iter_table_of_df(self):
+        """
+            The dictionaries of the rows of table_of_df() one by one, e.g. to stream them. 
+            The dataframe is read before the first row is returned, so errors are raised at once. 
+        """
+        df = self.table_frame()
+
+        ##### the whole dataframe is converted column-wise to normal int and float (numpy values cannot be used
+        ##### in dictionary in fastAPI), missing values are given as None
+        return iter_records(df)
+
+    def table_frame(self):
+        """
+            The dataframe of find_min_max_resistance_in_MA() with the column names of the DataTable, 
+            R is R_median if the file has R_ave. E.g. to give the table as Arrow or Parquet table. 
+        """
         df_MA, df = self.find_min_max_resistance_in_MA()
         
-        row_list = []
-        data_table = []
-        df_row_dict = {}
         cols = list(df.columns)
         if 'R_ave' in cols and 'R' in cols: 
             pos = cols.index('R')
             cols[pos] = 'R_median'
-        for i in range(len(df)):
-            for j,c in enumerate(cols):
-                celll = list(df.iloc[i])[j] 
-
-                ##### any method to take a cell value from a dataframe will return the value as numpy.float64 or numpy.int64 
-                ##### numpy values cannot be used in dictionary in fastAPI , so I used item() method to just have normal int and float :<<<
-                
-                if type(celll) == np.float64 or type(celll) == np.int64 :
-                    cell_val = celll.item()
-                else:
-                    cell_val = celll
-                    
-                #print(type(cell_val))
-                #The below method for taking cell value didnt work for txt files but it is easier than iloc!
-                #cell_val = df.at[i, c].item()
-                
-                df_row_dict[c] = cell_val
-            data_table.append(df_row_dict)
-            df_row_dict = {}
-#               
-        
-        return {
-                "DataTable":data_table
-                }      
+        ## only the column names are changed, on a shallow copy of the cached dataframe
+        df = df.copy(deep=False)
+        df.columns = cols
+        return df
 
+    @timed("aggregation")
     def info_R_in_MA_for_database(self):
         
-        same_dict = self.find_type_and_keyword()
-        created_column_name = self.create_column_name()
-        if len(same_dict)>1 and same_dict["keyword"] == 0 and len(created_column_name)>0 :
-            column_name = created_column_name
-        elif len(same_dict)>1 and same_dict["keyword"] > 0:
-            column_name = self.find_column_name()
-        else:
+        column_name = self.resolve_column_name()
+        if len(column_name) == 0:
             raise ValueError('file is not valid') 
         
             
@@ -872,40 +845,16 @@ class data_file:
 
 ######## Finding max and min of resistance in each temperature
         
+    @timed("aggregation")
+    @parsed_file_cache
     def find_min_max_resistance(self):
         #file_path, file_extention = self.final_file_path()
-        file_path = self.file_path
-        file_extention = self.file_extention
         df_measurment_type = self.file_devision()
-        skip_list, col_name = self.find_skiprows()
-        same_dict = self.find_type_and_keyword()
-        created_column_name = self.create_column_name()
-        if len(same_dict)>1 and same_dict["keyword"] == 0 and len(created_column_name)>0 :
-            column_name = created_column_name
-        elif len(same_dict)>1 and same_dict["keyword"] > 0:
-            column_name = self.find_column_name()
-        else:
+        column_name = self.resolve_column_name()
+        if len(column_name) == 0:
             return 'file is not valid' 
-        data_ana = {} 
-        if file_extention == ".csv":
-            df=pd.read_csv(file_path,names=column_name,skiprows= skip_list,encoding= self.encoding_pd_read_csv)
-        else:
-            df = pd.DataFrame(columns= column_name)
-            count_l = 0
-            f = open(file_path, encoding=self.encoding_open_file)
-            for line in f:
-                col = line.split()
-                if len(col)>1:
-                    count_l +=1
-                    df.loc[count_l] = col
-                    
-            for col_n in df.columns:
-                df[col_n] = df[col_n].apply(lambda x: x.replace(',', '.'))
-                
-            try: 
-                df= df.apply(pd.to_numeric)
-            except ValueError:
-                print(file_path,': contains non floatable columns')
+        ## negative values are removed from a copy, the dataframe of load_dataframe() is shared
+        df = self.load_dataframe().copy()
         
         if df_measurment_type["type_R1_R2_R3"].iloc[0] == 1:
             # finding negative measurements! 
@@ -946,6 +895,7 @@ class data_file:
 
             return df_R_detail
         
+    @timed("aggregation")
     def info_for_database(self):
         df_measurment_type = self.file_devision() 
         df_min_max= self.find_min_max_resistance()
@@ -1033,16 +983,11 @@ class data_file:
         data_ana = {} 
         if file_extention == ".csv":
             
-            df=pd.read_csv(file_path,names=column_name,skiprows= skip_list,encoding= self.encoding_pd_read_csv)
+            df=pd.read_csv(self.parsed_file.bytes_io(),names=column_name,skiprows= skip_list,encoding= self.encoding_pd_read_csv)
+        elif file_extention in COLUMNAR_FILE_FORMATS:
+            df = self.columnar_table(column_name)
         else:
-            df = pd.DataFrame(columns= column_name)
-            count_l = 0
-            f = open(file_path, encoding=self.encoding_open_file)
-            for line in f:
-                col = line.split()
-                if len(col)>1:
-                    count_l +=1
-                    df.loc[count_l] = col
+            df = read_numeric_table(self.parsed_file.text(self.encoding_open_file), column_name)
             
         for cn in column_name:
             min_col = df[cn].min()
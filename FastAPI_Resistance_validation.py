@@ -4,25 +4,49 @@ from typing import Optional, Annotated
 #from pydantic import BaseModel
 from Data_validation_and_classification_MA import data_file
 from cyclic_temperature_dependent import TemperatureFileProcessor
-import shutil
 import os
 #import io
 from io import StringIO
-import tempfile
 #import mimetypes
 import re
 import logging
 import datetime as dt
 import magic
 import json
-from fastapi.responses import JSONResponse
-
-
-def setup_logger(log_dir: str = "./Loggs") -> logging.Logger:
+import asyncio
+import atexit
+import contextlib
+import multiprocessing
+import functools
+import hashlib
+import io
+import zipfile
+from result_cache import ResultCache
+from contextlib import asynccontextmanager
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from serializers import ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE, dumps, pa
+import processing
+import metrics
+from processing import STREAM_MEDIA_TYPES
+from executor import WorkerPool
+from jobs import JOB_KINDS, JobRunner, JobStore
+from structured_logging import (LOG_BACKUP_COUNT, LOG_MAX_BYTES, LOG_ROTATE_SECONDS, PAYLOAD_MAX_BYTES,
+                                PAYLOAD_SAMPLE_RATE, QueueLogging, RotatingJsonFileHandler, StructuredQueueHandler,
+                                set_payload_sampling)
+from ingest import MAX_BODY_BYTES, SPOOL_MEMORY_BYTES, BodyEncodingError, BodyTooLarge, SpooledBody, receive_body
+
+
+def setup_logger(log_dir: str = "./Loggs", start_method: str = "spawn", max_bytes: int = LOG_MAX_BYTES,
+                 rotate_seconds: float = LOG_ROTATE_SECONDS, backup_count: int = LOG_BACKUP_COUNT) -> logging.Logger:
     """
     Setup a logger that creates a unique log file for each execution.
+    The logger only puts its records into a queue, a listener thread writes them to the file as JSON lines
+    (see structured_logging), so the requests do not wait for the file. The worker processes put their
+    records into the same queue. The file is rotated when it is larger than max_bytes or older than rotate_seconds.
 
     :param log_dir: Directory to store log files.
+    :param start_method: Start method of the worker processes, the queue is created for it.
     :return: Configured logger instance.
     """
     os.makedirs(log_dir, exist_ok=True)
@@ -37,22 +61,299 @@ def setup_logger(log_dir: str = "./Loggs") -> logging.Logger:
 
     # Avoid duplicate handlers
     if not logger.handlers:
-        handler = logging.FileHandler(log_file)
-        handler.setFormatter(
-            logging.Formatter(
-                "%(asctime)s - %(levelname)s - %(message)s",
-                datefmt="%y-%b-%d %H:%M:%S",
-            )
-        )
-        logger.addHandler(handler)
+        handler = RotatingJsonFileHandler(log_file, max_bytes, rotate_seconds, backup_count)
+        pipeline = QueueLogging(multiprocessing.get_context(start_method).Queue(), handler)
+        pipeline.start()
+        # the records that are still in the queue are written when the server stops
+        atexit.register(pipeline.stop)
+        logger.addHandler(StructuredQueueHandler(pipeline.queue))
 
     return logger
 
 
-# Set up a single unique logger for this execution
-logger = setup_logger()
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse written with serializers.dumps (orjson if it is installed): numpy scalars and arrays are written
+    natively and NaN/inf as null. The routes return it directly, so FastAPI does not run jsonable_encoder over the content.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# Start method of the worker processes (see worker_pool), the log queue is created for it
+EXECUTOR_START_METHOD = os.environ.get("RESISTANCE_EXECUTOR_START_METHOD", "spawn")
+
+# Set up a single unique logger for this execution: the log file is rotated when it is larger than
+# RESISTANCE_LOG_MAX_BYTES or older than RESISTANCE_LOG_ROTATE_SECONDS, RESISTANCE_LOG_BACKUPS rotated files are kept
+logger = setup_logger(
+    start_method=EXECUTOR_START_METHOD,
+    max_bytes=int(os.environ.get("RESISTANCE_LOG_MAX_BYTES", LOG_MAX_BYTES)),
+    rotate_seconds=float(os.environ.get("RESISTANCE_LOG_ROTATE_SECONDS", LOG_ROTATE_SECONDS)),
+    backup_count=int(os.environ.get("RESISTANCE_LOG_BACKUPS", LOG_BACKUP_COUNT)),
+)
+# Payloads (e.g. the response JSON) are logged for a share of RESISTANCE_LOG_PAYLOAD_SAMPLE_RATE of the requests,
+# at most RESISTANCE_LOG_PAYLOAD_MAX_BYTES of each
+PAYLOAD_SAMPLE_RATE = float(os.environ.get("RESISTANCE_LOG_PAYLOAD_SAMPLE_RATE", PAYLOAD_SAMPLE_RATE))
+PAYLOAD_MAX_BYTES = int(os.environ.get("RESISTANCE_LOG_PAYLOAD_MAX_BYTES", PAYLOAD_MAX_BYTES))
+set_payload_sampling(PAYLOAD_SAMPLE_RATE, PAYLOAD_MAX_BYTES)
+
+# Results of the routes for the same file content, see cached_route
+RESULT_CACHE_VERSION = "1"
+
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESISTANCE_CACHE_MAX_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("RESISTANCE_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+    ttl=float(os.environ.get("RESISTANCE_CACHE_TTL", 600)),
+)
+
+# Request bodies larger than RESISTANCE_SPOOL_MEMORY_BYTES are written to a spool file in RESISTANCE_SPOOL_DIR
+# (the temporary directory by default) while they are received, instead of being held in memory
+SPOOL_MEMORY_BYTES = int(os.environ.get("RESISTANCE_SPOOL_MEMORY_BYTES", SPOOL_MEMORY_BYTES))
+SPOOL_DIR = os.environ.get("RESISTANCE_SPOOL_DIR") or None
+# Largest accepted request body, after decompression of gzip/zstd bodies (413 Content Too Large otherwise)
+MAX_BODY_BYTES = int(os.environ.get("RESISTANCE_MAX_BODY_BYTES", MAX_BODY_BYTES))
+
+
+def requested_stream_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    """
+    The format in which the DataTable should be streamed: "ndjson" (one row per line), "json" (the usual
+    {"DataTable": [...]} document written row by row) or None to return the whole table at once.
+    The query parameter wins over the Accept header, which selects NDJSON with application/x-ndjson or application/ndjson.
+    """
+    if stream is not None:
+        if stream not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"stream must be one of {sorted(STREAM_MEDIA_TYPES)}")
+        return stream
+    accept = request.headers.get("accept", "")
+    if "application/x-ndjson" in accept or "application/ndjson" in accept:
+        return "ndjson"
+    return None
+
+
+# Binary table formats, selected with the Accept header
+TABLE_MEDIA_TYPES = {
+    "arrow": [ARROW_STREAM_MEDIA_TYPE, "application/vnd.apache.arrow.file"],
+    "parquet": [PARQUET_MEDIA_TYPE, "application/x-parquet"],
+}
+
+
+def requested_table_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    """
+    "arrow" or "parquet" if the Accept header asks for an Arrow IPC stream or a Parquet file, otherwise None.
+    The query parameter "stream" wins over the Accept header.
+    """
+    if stream is not None:
+        return None
+    accept = request.headers.get("accept", "")
+    for table_format, media_types in TABLE_MEDIA_TYPES.items():
+        if any(media_type in accept for media_type in media_types):
+            return table_format
+    return None
+
+
+def table_variant(request: Request) -> str:
+    """The representation of the DataTable that is requested, it is a part of the key of the result cache."""
+    stream = request.query_params.get("stream")
+    return requested_table_format(request, stream) or requested_stream_format(request, stream) or "json"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def _response_size(response) -> Optional[int]:
+    ## only complete successful responses are kept, streamed ones are computed for each request
+    if isinstance(response, StreamingResponse) or not isinstance(response, Response) or response.status_code != 200:
+        return None
+    return len(response.body)
+
+
+def close_after_stream(response: StreamingResponse, close) -> None:
+    """
+    Calls close() (e.g. of the request body) when a StreamingResponse is done, instead of when the route returns:
+    after the last chunk, or when the stream fails or is closed because the client disconnected. The stream
+    is closed first, so it has released what it reads (e.g. the spool file) before close() is called.
+    close() is also run as background task of the response, for a stream that was never started; it must
+    be safe to call it twice.
+    """
+    iterator = response.body_iterator
+    background = response.background
+
+    async def closing():
+        try:
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+            close()
+
+    async def after_response():
+        try:
+            if background is not None:
+                await background()
+        finally:
+            close()
+
+    response.body_iterator = closing()
+    response.background = BackgroundTask(after_response)
+
+
+def _copy_response(response: Response, etag: str) -> Response:
+    headers = {key: value for key, value in response.headers.items() if key not in ("content-length", "etag")}
+    headers["ETag"] = etag
+    return Response(response.body, status_code=response.status_code, headers=headers)
+
+
+async def received_body(request: Request):
+    """
+    The body of a request as ingest.ReceivedBody (see cached_route), with the errors of receive_body as
+    413 (too large), 415 (unsupported Content-Encoding) or 400 (damaged compressed body).
+    """
+    try:
+        with metrics.stage("body_read"):
+            body = await receive_body(request, SPOOL_MEMORY_BYTES, SPOOL_DIR, MAX_BODY_BYTES)
+    except BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BodyEncodingError as e:
+        raise HTTPException(status_code=415 if e.unsupported else 400, detail=str(e))
+    metrics.label(file_size=body.size)
+    if body.encoding:
+        logger.info(f"Request body decompressed from {body.encoding}: {body.size} bytes")
+    if body.spooled:
+        logger.info(f"Request body of {body.size} bytes spooled to {body.data.path}")
+    return body
+
+
+def cached_route(kind: str, variant=None):
+    """
+    Decorator for routes that compute their response from the request body only.
+    The responses are kept in result_cache under the SHA-256 of the body, the kind of the route and
+    variant(request) (e.g. the requested format), so the same file posted again is not processed again,
+    and concurrent requests with the same file wait for one computation.
+    Every response has an ETag of that key; a request whose If-None-Match contains it gets 304 Not Modified
+    without processing the file.
+    The body is received chunk by chunk and hashed on the way (ingest.receive_body), large bodies are spooled
+    to disk; the route finds it in request.state.body and the spool file is removed when the route returns,
+    or for a streamed response when the stream is done (it may still read the body).
+    gzip and zstd compressed bodies (Content-Encoding, or recognised by their magic number) are decompressed
+    while they are received, the key is that of the decompressed file.
+    """
+    def decorator(route):
+        @functools.wraps(route)
+        async def wrapper(*args, **kwargs):
+            request = next(value for value in list(args) + list(kwargs.values()) if isinstance(value, Request))
+            body = await received_body(request)
+            request.state.body = body
+            response = None
+            try:
+                key = f"{RESULT_CACHE_VERSION}:{kind}:{variant(request) if variant else ''}:{body.sha256}"
+                etag = '"' + hashlib.sha256(key.encode()).hexdigest()[:40] + '"'
+
+                if _etag_matches(request.headers.get("if-none-match"), etag):
+                    return Response(status_code=304, headers={"ETag": etag})
+
+                async def compute():
+                    return await route(*args, **kwargs)
+
+                response = await result_cache.get_or_compute(key, compute, _response_size)
+            finally:
+                if isinstance(response, StreamingResponse):
+                    close_after_stream(response, body.close)
+                else:
+                    body.close()
+            if _response_size(response) is None:
+                response.headers["ETag"] = etag
+                return response
+            return _copy_response(response, etag)
+        return wrapper
+    return decorator
+
+
+def result_response(result: processing.Result) -> Response:
+    """The response of a processing.Result: a streamed response for an iterator of chunks, the body otherwise."""
+    if isinstance(result.body, (bytes, memoryview)):
+        return Response(result.body, media_type=result.media_type)
+    if hasattr(result.body, "__next__"):
+        return StreamingResponse(result.body, media_type=result.media_type)
+    # a pyarrow Buffer, sent without copying it
+    return Response(memoryview(result.body), media_type=result.media_type)
+
+
+def check_table_format(table_format: Optional[str]) -> None:
+    if table_format and pa is None:
+        raise HTTPException(status_code=406, detail="Arrow and Parquet output are not available, pyarrow is not installed.")
+
+
+# The processing of the files runs in a pool of warm workers, not on the event loop:
+# RESISTANCE_EXECUTOR is "process" (default) or "thread", RESISTANCE_EXECUTOR_WORKERS the number of workers
+worker_pool = WorkerPool(
+    kind=os.environ.get("RESISTANCE_EXECUTOR", "process"),
+    max_workers=int(os.environ.get("RESISTANCE_EXECUTOR_WORKERS", 0)) or None,
+    start_method=EXECUTOR_START_METHOD,
+    initializer=processing.log_to_server,
+    initargs=(logger.handlers[0].queue, PAYLOAD_SAMPLE_RATE, PAYLOAD_MAX_BYTES),
+)
+
+
+async def run_processing(func, *args):
+    """
+    await func(*args) in the worker pool, the stages that are timed in the worker are added to the
+    Server-Timing header and the histograms of the request (see metrics).
+    """
+    result, seconds, labels = await worker_pool.run(metrics.timed_call, func, *args)
+    metrics.record(seconds, labels)
+    return result
+
 
-app = FastAPI(docs_url="/")
+async def run_processing_in_thread(func, *args):
+    """run_processing() in a thread of the pool, for functions that return an iterator."""
+    result, seconds, labels = await worker_pool.run_in_thread(metrics.timed_call, func, *args)
+    metrics.record(seconds, labels)
+    return result
+
+
+# Jobs of /resistance/jobs are kept in RESISTANCE_JOBS_DIR: at most RESISTANCE_JOBS_MAX finished jobs with
+# RESISTANCE_JOBS_MAX_BYTES of results, each for RESISTANCE_JOBS_TTL seconds; RESISTANCE_JOBS_CONCURRENCY jobs run at once
+job_store = JobStore(
+    os.environ.get("RESISTANCE_JOBS_DIR", "./Jobs"),
+    max_jobs=int(os.environ.get("RESISTANCE_JOBS_MAX", 100)),
+    max_bytes=int(os.environ.get("RESISTANCE_JOBS_MAX_BYTES", 2 * 1024 * 1024 * 1024)),
+    ttl=float(os.environ.get("RESISTANCE_JOBS_TTL", 24 * 3600)),
+)
+job_runner = JobRunner(
+    job_store,
+    worker_pool.run,
+    concurrency=int(os.environ.get("RESISTANCE_JOBS_CONCURRENCY", 0)) or max(1, worker_pool.max_workers // 2),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the workers are started before the first request, so it does not wait for pandas to be imported
+    await asyncio.get_running_loop().run_in_executor(None, worker_pool.start)
+    await asyncio.to_thread(job_store.initialize)
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    worker_pool.shutdown()
+
+
+app = FastAPI(docs_url="/", default_response_class=FastJSONResponse, lifespan=lifespan)
+# Server-Timing header and Prometheus histograms of the stages of each request
+app.add_middleware(metrics.TimingMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """The timings of the stages of the requests of this server process in the Prometheus text format."""
+    if metrics.prometheus_client is None:
+        raise HTTPException(status_code=501, detail="Metrics are not available, prometheus_client is not installed.")
+    return Response(metrics.latest(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.post(
@@ -70,64 +371,26 @@ app = FastAPI(docs_url="/")
         }
     },
 )
-async def Incoming_stream_processing_to_get_DataTable(request: Request):
+@cached_route("csv/data/tablebody", variant=table_variant)
+async def Incoming_stream_processing_to_get_DataTable(
+    request: Request,
+    stream: Annotated[Optional[str], Query(description="Stream the DataTable as 'ndjson' or 'json'")] = None,
+):
     logger.info("Incoming request received")
+    stream_format = requested_stream_format(request, stream)
+    table_format = requested_table_format(request, stream)
+    check_table_format(table_format)
 
     # Read file bytes from the request
-    byte_data = await request.body()
+    byte_data = request.state.body.data
     logger.info(f"File data read from request body successfully.")
 
-    # Detect file type using python-magic
-    file_type = magic.from_buffer(byte_data, mime=True)
-    logger.info(f"Detected file type: {file_type}")
-
-    # Map detected file type to appropriate extensions
-    extension_map = {
-        "text/csv": ".csv",
-        "application/vnd.ms-excel": ".xls",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
-        "application/json": ".json",
-    }
-    # Fallback to .csv if the type is unknown
-    extension = extension_map.get(file_type, ".csv")
-    logger.info(f"File extension determined as: {extension}")
-
-    # Create a temporary file with the determined extension
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
-
-    try:
-        # Write data to temp file and close it
-        temp_file.write(byte_data)
-        temp_file.close()
-        file_path = temp_file.name
-        logger.info(f"Temporary file created: {file_path}")
-
-        # Use your validation logic on the saved file
-        new_file = data_file(file_path)
-        cyclic_temp_file = TemperatureFileProcessor(file_path)
-        logger.info("Starting data validation and processing.")
-
-        same_col_dict = new_file.find_type_and_keyword()
-        logger.info(f"same_col_dict contents: {same_col_dict}")
-
-        no_col = list(same_col_dict.keys())[1]
-        logger.info(f"Column type detected: {no_col}")
-
-        if no_col == 343:
-            logger.info("Processing data as cyclic temperature file.")
-            table = cyclic_temp_file.table_of_df_temp()
-        else:
-            logger.info("Processing data as general file.")
-            table = new_file.table_of_df()
-
-        logger.info("Data processing completed successfully.")
-
-    finally:
-        # Ensure temp file is deleted after processing
-        os.unlink(file_path)
-        logger.info(f"Temporary file deleted: {file_path}")
-
-    return table
+    # The format is detected with python-magic and the file is processed in the worker pool
+    if stream_format:
+        result = await run_processing_in_thread(processing.data_table_stream, byte_data, None, stream_format)
+    else:
+        result = await run_processing(processing.data_table, byte_data, None, table_format)
+    return result_response(result)
 
 
 @app.post(
@@ -145,23 +408,26 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
-async def Incoming_stream_processing_to_get_DataTable(request: Request):
-    byte_data = await request.body()
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-    temp_file.write(byte_data)
-    temp_file.close()
-    file_path = temp_file.name
-
-    new_file = data_file(file_path)
-    data_table = new_file.table_of_df()
-    os.unlink(file_path)
-
-    return data_table
+@cached_route("txt/data/tablebody", variant=table_variant)
+async def Incoming_stream_processing_to_get_DataTable(
+    request: Request,
+    stream: Annotated[Optional[str], Query(description="Stream the DataTable as 'ndjson' or 'json'")] = None,
+):
+    stream_format = requested_stream_format(request, stream)
+    table_format = requested_table_format(request, stream)
+    check_table_format(table_format)
+    byte_data = request.state.body.data
+
+    if stream_format:
+        result = await run_processing_in_thread(processing.data_table_stream, byte_data, '.txt', stream_format)
+    else:
+        result = await run_processing(processing.data_table, byte_data, '.txt', table_format)
+    return result_response(result)
 
 
 @app.post(
     "/resistance/csv/data/databasevaluesbody",
-    response_class=JSONResponse,
+    response_class=FastJSONResponse,
     openapi_extra={
         "requestBody": {
             "content": {
@@ -174,67 +440,17 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("csv/data/databasevaluesbody")
 async def Incoming_stream_processing_to_get_DataTable(request: Request):
     logger.info("Incoming request received")
     try:
-        byte_data = await request.body()
+        byte_data = request.state.body.data
         file_size = len(byte_data)
         logger.info(f"File data read from request body successfully. File size: {file_size} bytes")
 
-        # Detect file type using python-magic
-        file_type = magic.from_buffer(byte_data, mime=True)
-        logger.info(f"Detected file type: {file_type}")
-
-        # Map detected file type to appropriate extensions
-        extension_map = {
-            "text/csv": ".csv",
-            "application/vnd.ms-excel": ".xls",
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
-            "application/json": ".json",
-        }
-        extension = extension_map.get(file_type, ".csv")
-        logger.info(f"File extension determined as: {extension}")
-
-        # Create a temporary file with the determined extension
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
-
-        try:
-            temp_file.write(byte_data)
-            temp_file.close()
-            file_path = temp_file.name
-            logger.info(f"Temporary file created: {file_path}")
-
-            # Use your validation logic on the saved file
-            new_file = data_file(file_path)
-            cyclic_temp_file = TemperatureFileProcessor(file_path)
-            logger.info("Starting data validation and processing.")
-            try:
-                same_col_dict = new_file.find_type_and_keyword()
-            except Exception as e:
-                logger.error(f"Error during `find_type_and_keyword`: {str(e)}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Failed to process the file.")
-            logger.info(f"same_col_dict contents: {same_col_dict}")
-            no_col = list(same_col_dict.keys())[1]
-            logger.info(f"Column type detected: {no_col}")
-
-            if no_col == 343:
-                logger.info("Processing data as cyclic temperature file.")
-                rMin_rMax_MA_values = cyclic_temp_file.info_R_in_MA_for_database_temp()
-            else:
-                logger.info("Processing data as general file.")
-                rMin_rMax_MA_values = new_file.info_R_in_MA_for_database()
-
-            logger.info("Data processing completed successfully.")
-        finally:
-            os.unlink(file_path)
-            logger.info(f"Temporary file deleted: {file_path}")
-
-        logger.info(f"Response JSON: {json.dumps(rMin_rMax_MA_values, indent=4)}")
-        # return rMin_rMax_MA_values
-        # return json.dumps(rMin_rMax_MA_values, indent=4)
-        # return rMin_rMax_MA_values
-
-
+        # The format is detected with python-magic and the file is processed in the worker pool
+        result = await run_processing(processing.database_values, byte_data)
+        return result_response(result)
 
     except Exception as e:
         logger.error(f"Error during processing: {str(e)}", exc_info=True)
@@ -256,18 +472,12 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("txt/data/databasevaluesbody")
 async def Incoming_stream_processing_to_get_DataTable(request: Request):
-    byte_data = await request.body()
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-    temp_file.write(byte_data)
-    temp_file.close()
-    file_path = temp_file.name
-
-    new_file = data_file(file_path)
-    rMin_rMax_MA_values = new_file.info_R_in_MA_for_database()
-    os.unlink(file_path)
+    byte_data = request.state.body.data
 
-    return rMin_rMax_MA_values
+    result = await run_processing(processing.database_values, byte_data, '.txt')
+    return result_response(result)
 
 
 @app.post(
@@ -285,48 +495,14 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("csv/overall/data/databasevaluesbody")
 async def Incoming_stream_processing_to_get_DataTable(request: Request):
     # Read file bytes from the request
-    byte_data = await request.body()
-
-    # Detect file type using python-magic
-    file_type = magic.from_buffer(byte_data, mime=True)
-
-    # Map detected file type to appropriate extensions
-    extension_map = {
-        "text/csv": ".csv",
-        "application/vnd.ms-excel": ".xls",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
-        "application/json": ".json",
-    }
-    # Fallback to .csv if the type is unknown
-    extension = extension_map.get(file_type, ".csv")
+    byte_data = request.state.body.data
 
-    # Create a temporary file with the determined extension
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
-
-    try:
-        # Write data to temp file and close it
-        temp_file.write(byte_data)
-        temp_file.close()
-        file_path = temp_file.name
-        print("Temporary file saved as:", file_path)
-
-        # Use your validation logic on the saved file
-        new_file = data_file(file_path)
-        cyclic_temp_file = TemperatureFileProcessor(file_path)
-        same_col_dict = new_file.find_type_and_keyword()
-        no_col = list(same_col_dict.keys())[1]
-        if no_col == 343:
-            rMin_rMax_MA_overall = cyclic_temp_file.info_for_database_temp()
-        else:
-            rMin_rMax_MA_overall = new_file.info_for_database()
-
-    finally:
-        # Ensure temp file is deleted after processing
-        os.unlink(file_path)
-
-    return rMin_rMax_MA_overall
+    # The format is detected with python-magic and the file is processed in the worker pool
+    result = await run_processing(processing.overall_values, byte_data)
+    return result_response(result)
 
 
 @app.post(
@@ -344,18 +520,12 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("txt/Overall/data/databasevaluesbody")
 async def Incoming_stream_processing_to_get_DataTable(request: Request):
-    byte_data = await request.body()
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-    temp_file.write(byte_data)
-    temp_file.close()
-    file_path = temp_file.name
-
-    new_file = data_file(file_path)
-    rMin_rMax_temperature_values = new_file.info_for_database()
-    os.unlink(file_path)
+    byte_data = request.state.body.data
 
-    return rMin_rMax_temperature_values
+    result = await run_processing(processing.overall_values, byte_data, '.txt')
+    return result_response(result)
 
 
 @app.post(
@@ -373,18 +543,12 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("txt/Overall/data/databasevaluesbody")
 async def Incoming_stream_processing_to_get_DataTable(request: Request):
-    byte_data = await request.body()
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-    temp_file.write(byte_data)
-    temp_file.close()
-    file_path = temp_file.name
+    byte_data = request.state.body.data
 
-    new_file = data_file(file_path)
-    rMin_rMax_temperature_values = new_file.info_for_database()
-    os.unlink(file_path)
-
-    return rMin_rMax_temperature_values
+    result = await run_processing(processing.overall_values, byte_data, '.txt')
+    return result_response(result)
 
 
 @app.post(
@@ -401,80 +565,294 @@ async def Incoming_stream_processing_to_get_DataTable(request: Request):
         }
     },
 )
+@cached_route("csv/validation/body")
 async def validation_of_incoming_file(request: Request):
     # Read file bytes from the request
-    byte_data = await request.body()
+    byte_data = request.state.body.data
 
-    # Detect file type using python-magic
-    file_type = magic.from_buffer(byte_data, mime=True)
+    # The format is detected with python-magic and the file is processed in the worker pool
+    result = await run_processing(processing.validation, byte_data)
+    return result_response(result)
 
-    # Map detected file type to appropriate extensions
-    extension_map = {
-        "text/csv": ".csv",
-        "application/vnd.ms-excel": ".xls",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
-        "application/json": ".json",
-    }
-    # Fallback to .csv if the type is unknown
-    extension = extension_map.get(file_type, ".csv")
 
-    # Create a temporary file with the determined extension
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
+@app.post(
+    "/resistance/txt/validation/body",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/octet-stream": {
+                    "schema": {
+                        "type": "array",
 
-    try:
-        # Write data to temp file and close it
-        temp_file.write(byte_data)
-        temp_file.close()
-        file_path = temp_file.name
-        print("Temporary file saved as:", file_path)
+                    }
+                }
+            }
+        }
+    },
+)
+@cached_route("txt/validation/body")
+async def validation_of_incoming_file(request: Request):
+    byte_data = request.state.body.data
+
+    result = await run_processing(processing.validation, byte_data, '.txt')
+    return result_response(result)
+
+
+def requested_outputs(outputs: Optional[str]) -> list:
+    """The outputs of /resistance/analyze, from the comma separated query parameter (all outputs if it is not given)."""
+    if outputs is None:
+        return list(processing.ANALYZE_OUTPUTS)
+    requested = [output.strip() for output in outputs.split(",") if output.strip()]
+    unknown = [output for output in requested if output not in processing.ANALYZE_OUTPUTS]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"outputs must be a comma separated list of {', '.join(processing.ANALYZE_OUTPUTS)}",
+        )
+    return list(dict.fromkeys(requested))
+
+
+def analyze_variant(request: Request) -> str:
+    """The requested outputs and file format, they are a part of the key of the result cache."""
+    outputs = requested_outputs(request.query_params.get("outputs"))
+    return f"{','.join(outputs)}:{request.query_params.get('file_format') or ''}"
+
+
+@app.post(
+    "/resistance/analyze",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/octet-stream": {
+                    "schema": {
+                        "type": "array",
+                    }
+                }
+            }
+        }
+    },
+)
+@cached_route("analyze", variant=analyze_variant)
+async def analyze_incoming_file(
+    request: Request,
+    outputs: Annotated[Optional[str], Query(description="Comma separated outputs: validation,table,database,overall")] = None,
+    file_format: Annotated[Optional[str], Query(description="Extension of the file (e.g. '.txt'), detected if not given")] = None,
+):
+    """
+    Validation, DataTable and database payloads of one file from one parse, the client picks the outputs.
+    Files with 343 columns are handled as cyclic temperature files, as in the csv routes.
+    """
+    logger.info("Incoming request received")
+    selected = requested_outputs(outputs)
+    byte_data = request.state.body.data
+    logger.info(f"File data read from request body successfully. File size: {len(byte_data)} bytes")
 
-        # Use your validation logic on the saved file
-        new_file = data_file(file_path)
-        validation_status = new_file.file_validation()
+    result = await run_processing(processing.analyze, byte_data, file_format, selected)
+    return result_response(result)
 
+
+def batch_variant(request: Request) -> str:
+    """The requested outputs and whether the results are streamed, they are a part of the key of the result cache."""
+    outputs = requested_outputs(request.query_params.get("outputs"))
+    stream = request.query_params.get("stream")
+    return f"{','.join(outputs)}:{requested_stream_format(request, stream) or ''}"
+
+
+async def analyze_archive_members(archive: zipfile.ZipFile, members: list, outputs: list):
+    """
+    Yields (member, JSON body of processing.analyze_member) in the order in which the members are done.
+    The members are read from the archive in memory (nothing is extracted to disk, at most MAX_BODY_BYTES of
+    each member) and processed in the worker pool; at most twice as many members as there are workers are held
+    in memory at the same time. A member that can not be read gets an "Error" as result.
+    """
+    semaphore = asyncio.Semaphore(2 * worker_pool.max_workers)
+    reads = set()
+
+    async def process(member):
+        async with semaphore:
+            ## a read that has started is finished also if the task is cancelled, see below
+            read = asyncio.ensure_future(
+                worker_pool.run_in_thread(processing.read_member, archive, member, MAX_BODY_BYTES))
+            reads.add(read)
+            read.add_done_callback(reads.discard)
+            try:
+                byte_data = await asyncio.shield(read)
+            except (BodyTooLarge, zipfile.BadZipFile) as e:
+                logger.error(f"Archive member {member} could not be read: {str(e)}")
+                return member, processing.json_result({"Error": f"Failed to read {member}: {str(e)}"}).body
+            result = await run_processing(processing.analyze_member, byte_data, member, outputs)
+            return member, result.body
+
+    tasks = [asyncio.ensure_future(process(member)) for member in members]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
     finally:
-        # Ensure temp file is deleted after processing
-        os.unlink(file_path)
+        for task in tasks:
+            task.cancel()
+        # the threads that still read members use the archive, it can only be closed when they are done
+        await asyncio.gather(*reads, return_exceptions=True)
 
-    return validation_status
+
+@app.post(
+    "/resistance/batch",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/zip": {
+                    "schema": {
+                        "type": "string",
+                        "format": "binary",
+                    }
+                }
+            }
+        }
+    },
+)
+@cached_route("batch", variant=batch_variant)
+async def batch_of_incoming_files(
+    request: Request,
+    outputs: Annotated[Optional[str], Query(description="Comma separated outputs: validation,table,database,overall")] = None,
+    stream: Annotated[Optional[str], Query(description="'ndjson' to stream one line per file as soon as it is done")] = None,
+):
+    """
+    A zip archive of many measurement files (.csv, .txt, .xlsx, .parquet, .arrow, .npy, also in per-library folders) in one request.
+    The files are processed in parallel in the worker pool, the result of each file is the one of
+    /resistance/analyze, keyed by the member name: {"files": {member: {output: ...}}, "skipped": [...]}.
+    With stream=ndjson (or Accept: application/x-ndjson) one line {"file": member, "result": {...}} is sent
+    for each file as soon as it is done, the last line is {"skipped": [...]}.
+    """
+    logger.info("Incoming batch request received")
+    selected = requested_outputs(outputs)
+    stream_format = requested_stream_format(request, stream)
+    if stream_format not in (None, "ndjson"):
+        raise HTTPException(status_code=400, detail="The batch results can only be streamed as 'ndjson'")
+    byte_data = request.state.body.data
+    try:
+        # a spooled archive is read from its file, which is removed (cached_route) after the archive is closed
+        archive = zipfile.ZipFile(byte_data.path if isinstance(byte_data, SpooledBody) else io.BytesIO(byte_data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="The request body is not a zip archive.")
+    members, skipped = processing.archive_members(archive, MAX_BODY_BYTES)
+    logger.info(f"Batch of {len(members)} files, {len(skipped)} members skipped")
+
+    if stream_format:
+        ## the archive is read while the lines are sent and closed at the end of the stream
+        async def lines():
+            try:
+                async with contextlib.aclosing(analyze_archive_members(archive, members, selected)) as done:
+                    async for member, body in done:
+                        yield b'{"file":' + dumps(member) + b',"result":' + body + b'}\n'
+                yield b'{"skipped":' + dumps(skipped) + b'}\n'
+            finally:
+                archive.close()
+        return StreamingResponse(lines(), media_type=STREAM_MEDIA_TYPES["ndjson"],
+                                 background=BackgroundTask(archive.close))
+
+    results = {}
+    with archive:
+        async with contextlib.aclosing(analyze_archive_members(archive, members, selected)) as done:
+            async for member, body in done:
+                results[member] = body
+    files = b",".join(dumps(member) + b":" + results[member] for member in members)
+    return Response(b'{"files":{' + files + b'},"skipped":' + dumps(skipped) + b'}', media_type="application/json")
+
+
+def job_response(job: dict) -> dict:
+    """The status of a job for the clients, with the URLs of its status and of its result."""
+    return {
+        "job_id": job["id"],
+        **{key: value for key, value in job.items() if key != "id"},
+        "status_url": f"/resistance/jobs/{job['id']}",
+        "result_url": f"/resistance/jobs/{job['id']}/result",
+    }
 
 
 @app.post(
-    "/resistance/txt/validation/body",
+    "/resistance/jobs",
+    status_code=202,
     openapi_extra={
         "requestBody": {
             "content": {
                 "application/octet-stream": {
                     "schema": {
                         "type": "array",
-
                     }
                 }
             }
         }
     },
 )
-async def validation_of_incoming_file(request: Request):
-    byte_data = await request.body()
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-    temp_file.write(byte_data)
-    temp_file.close()
-    file_path = temp_file.name
+async def submit_job(
+    request: Request,
+    kind: Annotated[str, Query(description="'analyze' (as /resistance/analyze) or 'table' (the DataTable)")] = "analyze",
+    outputs: Annotated[Optional[str], Query(description="Comma separated outputs of an analyze job: validation,table,database,overall")] = None,
+    file_format: Annotated[Optional[str], Query(description="Extension of the file (e.g. '.txt'), detected if not given")] = None,
+    table_format: Annotated[Optional[str], Query(description="'arrow' or 'parquet' for the DataTable of a table job, JSON if not given")] = None,
+):
+    """
+    Queues the processing of a file that takes longer than a request may wait and returns the id of the job at once
+    (202 Accepted). The status, stage and progress of the job are at status_url, the result is at result_url when
+    the status is "done". The result of an analyze job is the one of /resistance/analyze, that of a table job the
+    DataTable of the csv/txt routes (files with 343 columns are cyclic temperature files if file_format is not given).
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(JOB_KINDS)}")
+    if table_format not in (None, *TABLE_MEDIA_TYPES):
+        raise HTTPException(status_code=400, detail=f"table_format must be one of {', '.join(TABLE_MEDIA_TYPES)}")
+    check_table_format(table_format)
+    if kind == "analyze":
+        params = {"file_format": file_format, "outputs": requested_outputs(outputs)}
+    else:
+        params = {"file_format": file_format, "table_format": table_format}
+
+    body = await received_body(request)
+    try:
+        job_id = await asyncio.to_thread(job_store.submit, body.data, kind, params)
+    finally:
+        body.close()
+    job_runner.wake()
+    logger.info(f"Job {job_id} ({kind}) queued for a file of {body.size} bytes")
+    job = await asyncio.to_thread(job_store.get, job_id)
+    return JSONResponse(job_response(job), status_code=202, headers={"Location": f"/resistance/jobs/{job_id}"})
 
-    new_file = data_file(file_path)
-    validation_status = new_file.file_validation()
-    os.unlink(file_path)
-    return validation_status
 
+async def existing_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"There is no job {job_id}, it may have expired.")
+    return job
 
-@app.post("/resistance/validation/file")
-async def validation_of_incoming_file(file: UploadFile):
-    file_path = file.filename
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+@app.get("/resistance/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status ("queued", "running", "done", "failed"), stage and progress (0 to 1) of a job."""
+    return job_response(await existing_job(job_id))
+
 
-    new_file = data_file(file_path)
-    validation_status = new_file.file_validation()
-    return validation_status
+@app.get("/resistance/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """The result of a job that is done, 409 Conflict if it is still queued or running or if it failed."""
+    job = await existing_job(job_id)
+    if job["status"] != "done":
+        detail = f"The job failed: {job['error']}" if job["status"] == "failed" else f"The job is {job['status']}."
+        raise HTTPException(status_code=409, detail=detail)
+    return FileResponse(job_store.result_path(job_id), media_type=job["media_type"])
 
+
+@app.delete("/resistance/jobs/{job_id}", status_code=204)
+async def delete_job(job_id: str):
+    """Removes a job that is not running, with its result."""
+    job = await existing_job(job_id)
+    if not await asyncio.to_thread(job_store.delete, job_id):
+        raise HTTPException(status_code=409, detail=f"The job is {job['status']}, it can not be deleted.")
+    return Response(status_code=204)
+
+
+@app.post("/resistance/validation/file")
+async def validation_of_incoming_file(file: UploadFile):
+    # The extension of the file name gives the format, the content is processed in the worker pool
+    file_name = file.filename
+    byte_data = await file.read()
+    result = await run_processing(processing.validation, byte_data, os.path.splitext(file_name)[1], file_name)
+    return result_response(result)
@@ -0,0 +1,12 @@
+"""
+Benchmarks of the validation and classification of measurement files.
+
+    python -m benchmarks [--repeats N] [--cycles N] ... [--baseline benchmarks/baseline.json] [--update-baseline]
+
+generates synthetic files of every file family (generator), times the methods of data_file and
+TemperatureFileProcessor on them and records their peak memory (suite), and compares the results with the
+stored baseline: the command fails if a benchmark got slower (also when it is measured again) or needs more
+memory than the tolerance allows.
+"""
+from .generator import FAMILIES, generate_files
+from .suite import compare_to_baseline, load_results, remeasure, run_benchmarks, save_results
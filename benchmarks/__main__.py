@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from .generator import FAMILIES, generate_files
+from .suite import (MEMORY_TOLERANCE, TIME_TOLERANCE, compare_to_baseline, load_results, remeasure, run_benchmarks,
+                    save_results)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _print_result(name, result, baseline):
+    if "error" in result:
+        print(f"{name:<62} ERROR {result['error']}")
+        return
+    before = baseline["results"].get(name) if baseline else None
+    ratio = ""
+    if before and "error" not in before:
+        ratio = f"{result['min_seconds'] / before['min_seconds']:6.2f}x"
+    print(f"{name:<62} {result['min_seconds'] * 1000:10.1f} ms {ratio:>8} {result['peak_bytes'] / 2 ** 20:9.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark the validation and classification of measurement files.")
+    parser.add_argument("--families", nargs="+", choices=list(FAMILIES), help="file families, all by default")
+    parser.add_argument("--repeats", type=int, default=1, help="measurements of each of the 342 areas")
+    parser.add_argument("--temperatures", type=int, default=3, help="T_set steps of the temperature-dependent files")
+    parser.add_argument("--cycles", type=int, default=3, help="heating/cooling cycles of the cyclic files")
+    parser.add_argument("--steps", type=int, default=8, help="temperature steps of each ramp of the cyclic files")
+    parser.add_argument("--runs", type=int, default=5, help="timed calls of each method")
+    parser.add_argument("--directory", help="directory for the generated files, a temporary directory by default")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="stored baseline JSON")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE,
+                        help="allowed relative increase of the fastest time")
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE,
+                        help="allowed relative increase of the peak memory")
+    args = parser.parse_args(argv)
+
+    sizes = {"repeats": args.repeats, "temperatures": args.temperatures, "cycles": args.cycles, "steps": args.steps}
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        baseline = load_results(args.baseline)
+        if baseline["meta"].get("sizes") != sizes:
+            print(f"The baseline was measured with other file sizes ({baseline['meta'].get('sizes')}), "
+                  f"it is not compared", file=sys.stderr)
+            baseline = None
+
+    with tempfile.TemporaryDirectory(prefix="resistance-benchmarks-") as temporary:
+        paths = generate_files(args.directory or temporary, families=args.families, **sizes)
+        results = run_benchmarks(paths, args.runs, sizes,
+                                 progress=lambda name, result: _print_result(name, result, baseline))
+
+        regressions = []
+        if baseline is not None:
+            regressions = compare_to_baseline(results, baseline, args.time_tolerance, args.memory_tolerance)
+            slower = [regression["benchmark"] for regression in regressions if regression["metric"] == "min_seconds"]
+            if slower:
+                ## the files are still there to measure the slower benchmarks again
+                print(f"Measuring {len(slower)} slower benchmarks again")
+                remeasure(results, slower, paths, args.runs)
+                regressions = compare_to_baseline(results, baseline, args.time_tolerance, args.memory_tolerance)
+
+    if args.output:
+        save_results(results, args.output)
+    if args.update_baseline:
+        save_results(results, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        return 0
+
+    if regressions:
+        print(f"{len(regressions)} regressions against {args.baseline}:")
+        print(json.dumps(regressions, indent=4))
+        return 1
+    print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
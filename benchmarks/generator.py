@@ -0,0 +1,142 @@
+"""
+Synthetic measurement files of every family that data_file and TemperatureFileProcessor recognise.
+The .txt files have no header, their column names are inferred by create_column_name().
+
+    generate_files(directory, repeats=1, temperatures=3, cycles=3, steps=8) --> {family: path}
+
+The files describe a library of AREAS measurement areas on a grid of x, y coordinates with a smooth
+resistance map; the same seed gives the same files. The size is set by
+    repeats --> measurements of each area (rows of the RT files = AREAS * repeats)
+    temperatures --> T_set steps of the temperature-dependent files (rows = AREAS * repeats * temperatures)
+    cycles, steps --> heating/cooling cycles of the cyclic files and the temperature steps of each ramp
+                      (rows = 2 * cycles * steps + 1, always 343 columns: T and MA001...MA342)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+# Measurement areas of a library, on a grid of 18 x 19 positions 4.5 mm apart
+AREAS = 342
+GRID_COLUMNS = 18
+GRID_PITCH = 4.5
+# Relative noise of the repeated resistance measurements of one area (R1, R2, R3 agree within 10 %)
+NOISE = 0.01
+# Temperatures of the temperature-dependent and the cyclic files
+ROOM_TEMPERATURE = 25
+MAX_TEMPERATURE = 200
+
+# family --> (file name, description); the names contain RT or MA, as the file names of the libraries
+FAMILIES = {
+    "rt_xy_csv": ("bench_RT_xy.csv", "RT file x,y,R1,R2,R3 with header"),
+    "rt_xy_txt": ("bench_RT_xy.txt", "RT file x y R1 R2 R3 of the instrument: tab separated, decimal comma, no header"),
+    "t_set_csv": ("bench_MA_tset.csv", "temperature-dependent file x,y,R1,R2,R3,T_set"),
+    "keyword_header_csv": ("bench_RT_keyword.csv",
+                           "RT file with metadata lines before the keyword header x,y,Resistance"),
+    "ma_column_csv": ("bench_MA_column.csv", "temperature-dependent file MA,T_set,R"),
+    "cyclic_csv": ("bench_cyclic.csv", "cyclic temperature file T,MA001...MA342 with heating and cooling cycles"),
+    "cyclic_xlsx": ("bench_cyclic.xlsx", "cyclic temperature file as Excel sheet"),
+    "headerless_txt": ("bench_MA_headerless.txt", "temperature-dependent file x y R1 R2 R3 T_set without header"),
+}
+
+
+def _library(rng):
+    ## coordinates and room temperature resistance of the areas: a smooth gradient with a little scatter
+    index = np.arange(AREAS)
+    x = (index % GRID_COLUMNS) * GRID_PITCH - 40.0
+    y = (index // GRID_COLUMNS) * GRID_PITCH - 40.0
+    resistance = 20.0 + 0.2 * (x + 40.0) + 0.1 * (y + 40.0) + rng.uniform(0.0, 2.0, AREAS)
+    return x, y, resistance
+
+
+def _temperature_factor(temperature):
+    return 1.0 + 0.004 * (np.asarray(temperature, dtype=float) - ROOM_TEMPERATURE)
+
+
+def _rt_frame(rng, repeats, resistance_columns=("R1", "R2", "R3")):
+    x, y, resistance = _library(rng)
+    frame = pd.DataFrame({"x": np.tile(x, repeats), "y": np.tile(y, repeats)})
+    base = np.tile(resistance, repeats)
+    for column in resistance_columns:
+        frame[column] = (base * (1 + rng.normal(0.0, NOISE, len(base)))).round(4)
+    return frame
+
+
+def _t_set_frame(rng, repeats, temperatures):
+    steps = np.linspace(ROOM_TEMPERATURE, MAX_TEMPERATURE, temperatures).round()
+    frames = []
+    for temperature in steps:
+        frame = _rt_frame(rng, repeats)
+        for column in ("R1", "R2", "R3"):
+            frame[column] = (frame[column] * _temperature_factor(temperature)).round(4)
+        frame["T_set"] = int(temperature)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _ma_frame(rng, repeats, temperatures):
+    _, _, resistance = _library(rng)
+    steps = np.linspace(ROOM_TEMPERATURE, MAX_TEMPERATURE, temperatures).round()
+    rows = len(steps) * repeats
+    base = np.tile(resistance, rows)
+    temperature = np.repeat(np.tile(steps, repeats), AREAS)
+    return pd.DataFrame({
+        "MA": np.tile(np.arange(1, AREAS + 1), rows),
+        "T_set": temperature.astype(int),
+        "R": (base * _temperature_factor(temperature) * (1 + rng.normal(0.0, NOISE, len(base)))).round(4),
+    })
+
+
+def cyclic_temperatures(cycles, steps):
+    """The temperature steps of cycles heating and cooling ramps between room temperature and MAX_TEMPERATURE."""
+    ramp = np.linspace(ROOM_TEMPERATURE, MAX_TEMPERATURE, steps + 1)
+    cycle = np.concatenate([ramp[:-1], ramp[::-1][:-1]])
+    return np.append(np.tile(cycle, cycles), ROOM_TEMPERATURE).round(1)
+
+
+def _cyclic_frame(rng, cycles, steps):
+    _, _, resistance = _library(rng)
+    temperature = cyclic_temperatures(cycles, steps)
+    ## a little hysteresis: the resistance of the cooling ramps is higher than that of the heating ramps
+    cooling = np.concatenate([[False], np.diff(temperature) < 0])
+    factor = _temperature_factor(temperature) + 0.01 * cooling
+    values = np.outer(factor, resistance) * (1 + rng.normal(0.0, NOISE / 10, (len(temperature), AREAS)))
+    frame = pd.DataFrame(values.round(5), columns=[f"MA{number:03d}" for number in range(1, AREAS + 1)])
+    frame.insert(0, "T", temperature)
+    return frame
+
+
+def generate_files(directory, repeats=1, temperatures=3, cycles=3, steps=8, families=None, seed=0):
+    """
+    Writes the files of families (all FAMILIES by default) to directory and returns {family: path}.
+    cyclic_xlsx needs openpyxl.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = {}
+    for family in families or FAMILIES:
+        file_name, _ = FAMILIES[family]
+        path = os.path.join(directory, file_name)
+        if family == "rt_xy_csv":
+            _rt_frame(rng, repeats).to_csv(path, index=False)
+        elif family == "rt_xy_txt":
+            _rt_frame(rng, repeats).to_csv(path, index=False, header=False, sep="\t", decimal=",")
+        elif family == "t_set_csv":
+            _t_set_frame(rng, repeats, temperatures).to_csv(path, index=False)
+        elif family == "keyword_header_csv":
+            frame = _rt_frame(rng, repeats, resistance_columns=("Resistance",))
+            with open(path, "w", newline="") as f:
+                f.write("Library: benchmark\nOperator: generator\nInstrument: 4-point probe\n")
+                frame.to_csv(f, index=False)
+        elif family == "ma_column_csv":
+            _ma_frame(rng, repeats, temperatures).to_csv(path, index=False)
+        elif family == "cyclic_csv":
+            _cyclic_frame(rng, cycles, steps).to_csv(path, index=False)
+        elif family == "cyclic_xlsx":
+            _cyclic_frame(rng, cycles, steps).to_excel(path, index=False)
+        elif family == "headerless_txt":
+            _t_set_frame(rng, repeats, temperatures).to_csv(path, index=False, header=False, sep=" ")
+        else:
+            raise ValueError(f"Unknown file family {family!r}, the families are {', '.join(FAMILIES)}")
+        paths[family] = path
+    return paths
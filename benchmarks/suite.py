@@ -0,0 +1,172 @@
+"""
+Time and peak memory of the entry points of data_file and TemperatureFileProcessor for the generated files,
+and the comparison of the results with a stored baseline.
+
+Every call is made on a new instance, so it includes the reading and parsing of the file that the method
+needs (nothing is taken from the parsed-file artifact of an earlier call). Each method is called once to warm up,
+then runs times with the time of each call, and once more with tracemalloc for the peak memory.
+The baseline is compared by the fastest of the runs, which varies less than the median on a busy machine;
+a benchmark that is slower than the baseline is measured again (remeasure()) before it is reported.
+"""
+import collections
+import contextlib
+import datetime as dt
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from Data_validation_and_classification_MA import data_file
+from cyclic_temperature_dependent import TemperatureFileProcessor
+
+DATA_FILE_METHODS = ("find_type_and_keyword", "file_validation", "table_of_df", "info_R_in_MA_for_database",
+                     "info_for_database")
+TEMPERATURE_FILE_METHODS = ("load_matrix", "file_validation_temp", "find_min_max_resistance_in_MA", "table_of_df_temp",
+                            "iter_table_of_df_temp", "table_matrix_temp", "resistance_descriptions",
+                            "analyze_cycles_and_store_resistance_descriptions", "analyze_all",
+                            "info_R_in_MA_for_database_temp", "stream_info_R_in_MA_for_database_temp",
+                            "info_for_database_temp")
+CYCLIC_FAMILIES = ("cyclic_csv", "cyclic_xlsx")
+# data_file methods that are also used for cyclic temperature files (they find the 343 columns)
+CYCLIC_DATA_FILE_METHODS = ("find_type_and_keyword", "file_validation")
+
+# Default tolerances of compare_to_baseline(): relative increase of the time (the times of the same code vary by
+# about 30 % between runs on a shared machine) and of the peak memory (tracemalloc is exact), and the increase of
+# the time in seconds below which a change is noise
+TIME_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.25
+MIN_TIME_DIFFERENCE = 0.005
+
+
+def benchmarks_of(family):
+    """The (class name, method) pairs that are benchmarked for a file family."""
+    if family in CYCLIC_FAMILIES:
+        return ([("data_file", method) for method in CYCLIC_DATA_FILE_METHODS]
+                + [("TemperatureFileProcessor", method) for method in TEMPERATURE_FILE_METHODS])
+    return [("data_file", method) for method in DATA_FILE_METHODS]
+
+
+def _call(path, class_name, method):
+    instance = TemperatureFileProcessor(path) if class_name == "TemperatureFileProcessor" else data_file(path)
+    result = getattr(instance, method)()
+    ## iterators (e.g. the streamed DataTable) are consumed, their work is done while they are read
+    if hasattr(result, "__next__"):
+        collections.deque(result, maxlen=0)
+    return result
+
+
+def measure(path, class_name, method, runs=5):
+    """Median and minimum seconds of runs calls and the peak of the traced memory of one call, in bytes."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        ## the methods print their intermediate values
+        _call(path, class_name, method)
+        seconds = []
+        for _ in range(runs):
+            gc.collect()
+            start = time.perf_counter()
+            _call(path, class_name, method)
+            seconds.append(time.perf_counter() - start)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            _call(path, class_name, method)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        "seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(paths, runs=5, sizes=None, progress=None):
+    """
+    Measures the methods of every file of paths ({family: path}, see generator.generate_files) and returns
+    {"meta": {...}, "results": {"family.method": {"seconds", "min_seconds", "peak_bytes", "file_bytes"}}}.
+    A method that raises is given as {"error": ...}. progress(name, result) is called after each benchmark.
+    """
+    results = {}
+    for family, path in paths.items():
+        for class_name, method in benchmarks_of(family):
+            name = f"{family}.{method}"
+            try:
+                result = measure(path, class_name, method, runs)
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            result["file_bytes"] = os.path.getsize(path)
+            results[name] = result
+            if progress is not None:
+                progress(name, result)
+    return {
+        "meta": {
+            "created": dt.datetime.now().astimezone().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "runs": runs,
+            "sizes": sizes or {},
+        },
+        "results": results,
+    }
+
+
+def compare_to_baseline(current, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE,
+                        min_time_difference=MIN_TIME_DIFFERENCE):
+    """
+    The regressions of current against baseline (both as returned by run_benchmarks()): benchmarks whose fastest
+    time (min_seconds) grew by more than time_tolerance (and more than min_time_difference seconds) or whose
+    peak memory grew by more than memory_tolerance, and benchmarks that failed now but not in the baseline.
+    Returns a list of {"benchmark", "metric", "baseline", "current", "ratio"}.
+    """
+    regressions = []
+    for name, before in baseline["results"].items():
+        after = current["results"].get(name)
+        if after is None or "error" in before:
+            continue
+        if "error" in after:
+            regressions.append({"benchmark": name, "metric": "error", "baseline": None, "current": after["error"],
+                                "ratio": None})
+            continue
+        if (after["min_seconds"] > before["min_seconds"] * (1 + time_tolerance)
+                and after["min_seconds"] - before["min_seconds"] > min_time_difference):
+            regressions.append({"benchmark": name, "metric": "min_seconds", "baseline": before["min_seconds"],
+                                "current": after["min_seconds"], "ratio": after["min_seconds"] / before["min_seconds"]})
+        if before["peak_bytes"] and after["peak_bytes"] > before["peak_bytes"] * (1 + memory_tolerance):
+            regressions.append({"benchmark": name, "metric": "peak_bytes", "baseline": before["peak_bytes"],
+                                "current": after["peak_bytes"], "ratio": after["peak_bytes"] / before["peak_bytes"]})
+    return regressions
+
+
+def remeasure(results, names, paths, runs=5):
+    """
+    Measures the benchmarks names of results (e.g. those with a time regression) again with twice as many runs
+    and keeps the faster time, a slowdown that was only caused by other load of the machine does not remain.
+    """
+    for name in names:
+        family, method = name.split(".", 1)
+        class_name = next(class_ for class_, method_ in benchmarks_of(family) if method_ == method)
+        result = measure(paths[family], class_name, method, 2 * runs)
+        results["results"][name]["min_seconds"] = min(results["results"][name]["min_seconds"], result["min_seconds"])
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    ## written under a temporary name, so a baseline is never left half written
+    with open(path + ".tmp", "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(path + ".tmp", path)
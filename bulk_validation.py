@@ -0,0 +1,265 @@
+"""
+Validation and classification of whole directories of measurement files, without the web service.
+
+    python bulk_validation.py ROOT OUTPUT [--format jsonl|parquet] [--workers N]
+
+walks ROOT, processes the .csv, .txt, .xlsx, .parquet, .arrow and .npy files on all cores and writes
+one record per file to OUTPUT:
+    path, size --> the file (path relative to ROOT)
+    code, message, warning --> file_validation()
+    type --> the measurement type of file_devision() ("type_R", ..., "cyclic_temperature_dependant")
+    database --> info_for_database() (info_for_database_temp() for cyclic temperature files)
+    error --> the error of file_devision() / info_for_database(), None if there is none
+    seconds --> processing time of the file
+Invalid files (code 400 and 500) are only validated.
+
+OUTPUT is a JSONL file (one record per line, database as JSON object) or a directory of Parquet files
+(one part per batch of records, database as JSON text). The records are written batch by batch and the
+written records are the checkpoint: a run that is started again with the same OUTPUT skips the files
+that are already in it, so an interrupted run continues where it stopped.
+
+validate_directory() is the same as a function and returns the summary of the run.
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+
+from Data_validation_and_classification_MA import data_file
+from executor import warm_up_worker
+from processing import BATCH_FILE_FORMATS
+from serializers import dumps, pa, pq
+
+logger = logging.getLogger("bulk_validation")
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+CYCLIC_TYPE = "cyclic_temperature_dependant"
+# Validation codes of files that are not valid, their type and database values are not computed
+INVALID_CODES = (400, 500)
+# Number of failures that are listed in the summary
+SUMMARY_FAILURES = 20
+
+
+def iter_measurement_files(root):
+    """The paths of the measurement files below root, sorted, hidden files and folders are left out."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith(".") and name != "__MACOSX")
+        for file_name in sorted(file_names):
+            if not file_name.startswith(".") and os.path.splitext(file_name)[1].lower() in BATCH_FILE_FORMATS:
+                yield os.path.join(dir_path, file_name)
+
+
+def validate_file(path, root="."):
+    """The record of one file (see the module docstring), errors of the file are given in the record."""
+    start = time.perf_counter()
+    record = {
+        "path": os.path.relpath(path, root).replace(os.sep, "/"),
+        "size": os.path.getsize(path),
+        "code": None,
+        "message": None,
+        "warning": None,
+        "type": None,
+        "database": None,
+        "error": None,
+    }
+    try:
+        new_file = data_file(path)
+        validation = new_file.file_validation()
+        if validation is None:
+            raise ValueError("The file could not be validated")
+        record["code"] = validation["Code"]
+        record["message"] = validation["Message"]
+        record["warning"] = validation["Warning"]
+        if record["code"] not in INVALID_CODES:
+            if list(new_file.find_type_and_keyword().keys())[1] == 343:
+                record["type"] = CYCLIC_TYPE
+                record["database"] = new_file.cyclic_temp_processor.info_for_database_temp()
+            else:
+                measurement_type = new_file.file_devision().iloc[0]
+                record["type"] = next((name for name, value in measurement_type.items()
+                                       if name != "file_path" and value == 1), None)
+                record["database"] = new_file.info_for_database()
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def _quiet_worker():
+    ## the methods of data_file print their intermediate values, they are not needed in the workers
+    sys.stdout = open(os.devnull, "w")
+
+
+class _JsonlOutput:
+    def __init__(self, path):
+        self.path = path
+
+    def done_paths(self):
+        """The paths in the file, a last line that was not written completely is removed."""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "rb+") as f:
+            end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                done.add(json.loads(line)["path"])
+                end += len(line)
+            f.truncate(end)
+        return done
+
+    def write(self, records):
+        with open(self.path, "ab") as f:
+            f.write(b"".join(dumps(record) + b"\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class _ParquetOutput:
+    def __init__(self, path):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for Parquet output")
+        self.path = path
+        self.parts = 0
+        self.schema = pa.schema([
+            ("path", pa.string()),
+            ("size", pa.int64()),
+            ("code", pa.int64()),
+            ("message", pa.string()),
+            ("warning", pa.string()),
+            ("type", pa.string()),
+            ("database", pa.string()),
+            ("error", pa.string()),
+            ("seconds", pa.float64()),
+        ])
+
+    def done_paths(self):
+        done = set()
+        if not os.path.isdir(self.path):
+            return done
+        parts = sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+        for name in parts:
+            done.update(pq.read_table(os.path.join(self.path, name), columns=["path"]).column("path").to_pylist())
+        if parts:
+            self.parts = int(parts[-1][len("part-"):-len(".parquet")]) + 1
+        return done
+
+    def write(self, records):
+        os.makedirs(self.path, exist_ok=True)
+        columns = {key: [record[key] for record in records] for key in records[0]}
+        columns["database"] = [None if value is None else dumps(value).decode() for value in columns["database"]]
+        ## all parts have the same schema, also if a column of a batch has only None
+        table = pa.table(columns, schema=self.schema)
+        ## the part is written under a temporary name, so only complete parts are read when the run is continued
+        part = os.path.join(self.path, f"part-{self.parts:06d}.parquet")
+        pq.write_table(table, part + ".tmp")
+        os.replace(part + ".tmp", part)
+        self.parts += 1
+
+
+def validate_directory(root, output, output_format=None, workers=None, batch_size=256, restart=False):
+    """
+    Validates and classifies the measurement files below root in a pool of worker processes and writes
+    their records to output (see the module docstring), batch_size records at a time.
+    output_format: "jsonl" or "parquet", by default from the extension of output (.parquet or anything else).
+    Files that are already in output are skipped, restart=True removes output and starts again.
+    Returns the summary of the run: number of files, failures, validation codes and throughput.
+    """
+    if output_format is None:
+        output_format = "parquet" if output.endswith(".parquet") else "jsonl"
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {OUTPUT_FORMATS}, not {output_format!r}")
+    if restart and os.path.exists(output):
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        else:
+            os.remove(output)
+    writer = _ParquetOutput(output) if output_format == "parquet" else _JsonlOutput(output)
+    done = writer.done_paths()
+    if done:
+        logger.info(f"Continuing the run in {output}: {len(done)} files are already done")
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    files = skipped = failed = size = 0
+    codes = Counter()
+    failures = []
+    batch = []
+
+    def pending_paths():
+        nonlocal skipped
+        for path in iter_measurement_files(root):
+            if os.path.relpath(path, root).replace(os.sep, "/") in done:
+                skipped += 1
+            else:
+                yield path
+
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_up_worker, initargs=(_quiet_worker, ())
+    ) as pool:
+        ## at most 4 files per worker are submitted at once, so the walk of a large tree is not held in memory
+        paths = pending_paths()
+        running = set()
+        while True:
+            for path in paths:
+                running.add(pool.submit(validate_file, path, root))
+                if len(running) >= 4 * workers:
+                    break
+            if not running:
+                break
+            finished, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                files += 1
+                size += record["size"]
+                codes[record["code"]] += 1
+                if record["error"] is not None:
+                    failed += 1
+                    if len(failures) < SUMMARY_FAILURES:
+                        failures.append({"path": record["path"], "error": record["error"]})
+                batch.append(record)
+            if len(batch) >= batch_size:
+                writer.write(batch)
+                batch = []
+                logger.info(f"{files} files done, {failed} failed")
+        if batch:
+            writer.write(batch)
+
+    seconds = time.perf_counter() - start
+    return {
+        "files": files,
+        "skipped": skipped,
+        "failed": failed,
+        "codes": {str(code): count for code, count in sorted(codes.items(), key=lambda item: str(item[0]))},
+        "seconds": round(seconds, 3),
+        "files_per_second": round(files / seconds, 2) if seconds else None,
+        "megabytes_per_second": round(size / seconds / 1e6, 3) if seconds else None,
+        "failures": failures,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate and classify all measurement files below a directory.")
+    parser.add_argument("root", help="directory with the measurement files")
+    parser.add_argument("output", help="JSONL file or directory of Parquet files (.parquet) for the records")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, help="format of the output, by default from its extension")
+    parser.add_argument("--workers", type=int, help="number of worker processes, by default the number of cores")
+    parser.add_argument("--batch-size", type=int, default=256, help="number of records written at a time")
+    parser.add_argument("--restart", action="store_true", help="remove the output and start again instead of continuing")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    summary = validate_directory(args.root, args.output, args.format, args.workers, args.batch_size, args.restart)
+    print(json.dumps(summary, indent=4))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,20 +5,310 @@ import numpy as np
 import json
 import pprint
 import time
+from metrics import label, timed
+from parsed_file import ParsedFile, normalize_file_format, parsed_file_cache
+from serializers import RECORDS_CHUNK_ROWS, native_values
+from table_reader import COLUMNAR_FILE_FORMATS
+
+# Formats of the cyclic temperature files: CSV, Excel and the columnar binary formats
+CYCLIC_FILE_FORMATS = ['.csv', '.xlsx'] + list(COLUMNAR_FILE_FORMATS)
+
+
+class ResistanceMatrix:
+    """
+    Compact read-only content of a cyclic temperature file (T, MA1, ..., MA342):
+        columns: all column names of the file in their order
+        temp_column_name: 'T' or 'Temperature', None if the file has no temperature column
+        temperature: the temperature of each step, with the dtype of the file (None without temperature column)
+        ma_columns: the names of the other columns (the measurement areas)
+        values: contiguous float64 matrix of the resistance, shape (steps, len(ma_columns)), NaN for empty cells
+        ma_numbers: the number of each measurement area, parsed from its name ("MA007" --> 7), -1 if it has none
+    The arrays are not writeable, so one instance can be shared by all methods without copying it.
+    """
+
+    def __init__(self, columns, temp_column_name, temperature, ma_columns, values):
+        self.columns = list(columns)
+        self.temp_column_name = temp_column_name
+        self.temperature = temperature
+        self.ma_columns = list(ma_columns)
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.ma_numbers = np.array([_ma_number(col) for col in self.ma_columns], dtype=np.int64)
+        for array in [self.temperature, self.values, self.ma_numbers]:
+            if array is not None:
+                array.flags.writeable = False
+
+    @classmethod
+    def from_frame(cls, df):
+        """Builds the container from the DataFrame of the file, the first of 'T' and 'Temperature' is the temperature."""
+        temp_column_name = None
+        for col in ['T', 'Temperature']:
+            if col in df.columns:
+                temp_column_name = col
+                break
+
+        if temp_column_name is None:
+            temperature = None
+            resistance_columns = df
+        else:
+            temperature = np.array(df[temp_column_name].to_numpy())
+            resistance_columns = df.drop(columns=[temp_column_name])
+        values = resistance_columns.to_numpy(dtype=np.float64, na_value=np.nan)
+        return cls(df.columns, temp_column_name, temperature, resistance_columns.columns, values)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def columns_dict(self):
+        """
+        The temperature column and the MA columns as dictionary name --> 1D array, e.g. for arrow_table().
+        The matrix is copied once into column order, the columns are views of that copy.
+        """
+        columns = {self.temp_column_name: self.temperature}
+        by_column = np.asfortranarray(self.values)
+        for j, col in enumerate(self.ma_columns):
+            columns[col] = by_column[:, j]
+        return columns
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class ResistanceDescriptions:
+    """
+    Columnar form of the resistance descriptions of a cyclic temperature file.
+    The resistances stay in the (steps, MAs) matrix, the phase, cycle, name and comment are made once
+    per temperature step and the MA number once per column. The dictionaries for each pair of
+    temperature step and MA are only created at the edge, by records() and compositions(),
+    iter_compositions_json() writes the JSON text directly from the columns.
+    """
+
+    def __init__(self, matrix):
+        if matrix.temp_column_name != 'T':
+            raise KeyError('T')
+        ma_index = [j for j, col in enumerate(matrix.ma_columns) if col.startswith('MA')]
+        for j in ma_index:
+            if matrix.ma_numbers[j] == -1:
+                int(matrix.ma_columns[j][2:])  # raises the ValueError for a column name like 'MAx'
+        if len(ma_index) == len(matrix.ma_columns):
+            self.values = matrix.values
+        else:
+            self.values = matrix.values[:, ma_index]
+        self.ma_numbers = matrix.ma_numbers[ma_index]
+
+        self.temperature = matrix.temperature
+        self.phases, self.cycles = segment_cycles(matrix.temperature)
+        temperatures = matrix.temperature.tolist()
+        phases = self.phases.tolist()
+        cycles = self.cycles.tolist()
+        self.temperature_int = [int(temperature) for temperature in temperatures]
+        if max(cycles) > 1:
+            self.comments = [f"R{t}_{p}_cycle_{c}" for t, p, c in zip(temperatures, phases, cycles)]
+            self.data_names = [f"R{t}_{p}{c}" for t, p, c in zip(temperatures, phases, cycles)]
+        else:
+            self.comments = [f"R{t}_{p}" for t, p in zip(temperatures, phases)]
+            self.data_names = self.comments
+
+    def __len__(self):
+        return self.values.size
+
+    def columns(self):
+        """
+        The descriptions as whole arrays with one entry for each pair of temperature step and MA (row by row):
+        "measurement_area", "R", "temperature", "phase", "cycle", "comment", "data_name".
+        """
+        steps, no_ma = self.values.shape
+        return {
+            "measurement_area": np.tile(self.ma_numbers, steps),
+            "R": self.values.ravel(),
+            "temperature": np.repeat(np.array(self.temperature_int, dtype=np.int64), no_ma),
+            "phase": np.repeat(self.phases, no_ma),
+            "cycle": np.repeat(self.cycles, no_ma),
+            "comment": np.repeat(np.array(self.comments, dtype=object), no_ma),
+            "data_name": np.repeat(np.array(self.data_names, dtype=object), no_ma),
+        }
+
+    def records(self):
+        """One dictionary for each pair of temperature step and MA, as analyze_cycles_and_store_resistance_descriptions."""
+        ma_numbers = self.ma_numbers.tolist()
+        phases = self.phases.tolist()
+        cycles = self.cycles.tolist()
+        for i, row in enumerate(self.values):
+            for measurement_area, resistance_value in zip(ma_numbers, row):
+                yield {
+                    "measurement_area": measurement_area,
+                    "R": resistance_value,
+                    "temperature": self.temperature_int[i],
+                    "phase": phases[i],
+                    "cycle": cycles[i],
+                    "comment": self.comments[i],
+                    "data_name": self.data_names[i]
+                }
+
+    def compositions(self):
+        """One entry of compositionsForSampleUpdate for each pair of temperature step and MA."""
+        ma_numbers = self.ma_numbers.tolist()
+        for i, row in enumerate(self.values.tolist()):
+            data_name = self.data_names[i]
+            comment = self.comments[i]
+            for measurement_area, resistance_value in zip(ma_numbers, row):
+                yield {
+                    "predicate": {
+                        "properties": [
+                            {
+                                "Type": 2,
+                                "Name": "Measurement Area",
+                                "Value": measurement_area
+                            }
+                        ]
+                    },
+                    "deletePreviousProperties": False,
+                    "properties": [
+                        {
+                            "PropertyId": 0,
+                            "Type": 1,
+                            "Name": data_name,
+                            "Value": resistance_value,
+                            "ValueEpsilon": None,
+                            "SortCode": 10,
+                            "Row": None,
+                            "Comment": comment
+                        }
+                    ]
+                }
+
+    def iter_compositions_json(self, rows_per_chunk=64):
+        """
+        The JSON text of {"compositionsForSampleUpdate": [...]} in chunks of rows_per_chunk temperature steps,
+        the same text as json.dumps(..., separators=(",", ":"), ensure_ascii=False) of the compositions.
+        Raises ValueError at once (not while iterating) if a resistance is NaN or infinite.
+        """
+        if not np.isfinite(self.values).all():
+            raise ValueError("Out of range float values are not JSON compliant")
+        return self._compositions_json(rows_per_chunk)
+
+    def _compositions_json(self, rows_per_chunk):
+        heads = [
+            '{"predicate":{"properties":[{"Type":2,"Name":"Measurement Area","Value":%d}]},'
+            '"deletePreviousProperties":false,"properties":[{"PropertyId":0,"Type":1,"Name":' % measurement_area
+            for measurement_area in self.ma_numbers.tolist()
+        ]
+        yield '{"compositionsForSampleUpdate":['
+        separator = ''
+        for start in range(0, len(self.values), rows_per_chunk):
+            parts = []
+            for i, row in enumerate(self.values[start:start + rows_per_chunk].tolist(), start=start):
+                name = json.dumps(self.data_names[i], ensure_ascii=False) + ',"Value":'
+                tail = ',"ValueEpsilon":null,"SortCode":10,"Row":null,"Comment":' + json.dumps(self.comments[i], ensure_ascii=False) + '}]}'
+                parts.extend(head + name + repr(value) + tail for head, value in zip(heads, row))
+            if parts:
+                yield separator + ','.join(parts)
+                separator = ','
+        yield ']}'
+
+
+def iter_data_table(matrix, chunk_rows=RECORDS_CHUNK_ROWS):
+    """
+    The entries {"temperature": ..., "R": {MA column: resistance}} of the DataTable of a ResistanceMatrix.
+    The MA column names are taken once for all rows, the values are converted chunk by chunk to native Python
+    values (missing values are None). The temperature has the type of the resistances, as in a row of the DataFrame.
+    """
+    keys = matrix.ma_columns
+    temperature = matrix.temperature.astype(np.result_type(matrix.temperature, matrix.values))
+    for start in range(0, len(matrix), chunk_rows):
+        temperatures = native_values(temperature[start:start + chunk_rows])
+        rows = native_values(matrix.values[start:start + chunk_rows])
+        for temperature_value, row in zip(temperatures, rows):
+            yield {
+                "temperature": temperature_value,
+                "R": dict(zip(keys, row))
+            }
+
+
+def segment_cycles(temperature):
+    """
+    Heating/cooling phase and cycle number of each temperature step, computed in bulk.
+    A step is 'heating' if the temperature rises, 'cooling' if it falls and keeps the phase of the
+    previous step if it stays the same. The first step has the direction of the second one
+    ('cooling' if they are equal). The cycle starts at 1 and is counted up whenever the direction changes.
+
+    Returns:
+        an array with 'heating'/'cooling' and an int64 array with the cycle of each step
+    """
+    temperature = np.asarray(temperature)
+    if len(temperature) < 2:
+        raise IndexError("single positional indexer is out-of-bounds")
+    step = np.diff(temperature)
+    # +1 heating, -1 cooling, 0 for a plateau (also for NaN, which is neither rising nor falling)
+    direction = np.where(step > 0, 1, np.where(step < 0, -1, 0))
+    direction = np.concatenate(([1 if temperature[1] > temperature[0] else -1], direction))
+
+    # A plateau takes the direction of the last step that was not a plateau
+    last_change = np.maximum.accumulate(np.where(direction != 0, np.arange(len(direction)), 0))
+    direction = direction[last_change]
+
+    cycles = np.concatenate(([1], 1 + np.cumsum(direction[1:] != direction[:-1])))
+    phases = np.array(['cooling', 'heating'], dtype=object)[(direction > 0).astype(np.intp)]
+    return phases, cycles
+
+
+def _ma_number(col):
+    if isinstance(col, str) and col.startswith('MA') and col[2:].isdigit():
+        return int(col[2:])
+    return -1
+
 
 class TemperatureFileProcessor:
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, file_format=None, name=None, parsed_file=None):
+        """
+        file_path: the path of the file, or the content of the file as bytes, memoryview or binary file-like object.
+        file_format: the extension of the file (".csv", ".xlsx", ".parquet", ".arrow", ".npy"). It is required if the
+        content is given directly,
+        for a path it replaces the extension of the path.
+        name: the file name of content that is given directly.
+        parsed_file: the parsed-file artifact of a data_file of the same file, file_path is then only its name.
+        """
+        if parsed_file is None:
+            parsed_file = ParsedFile(file_path)
+            if parsed_file.in_memory:
+                if file_format is None:
+                    raise ValueError("file_format is required if the content of the file is given directly")
+                file_path = name if name is not None else ''
+        self.parsed_file = parsed_file
         self.file_path = file_path
         self.file_name = os.path.splitext(file_path)[0]
-        self.file_extension = os.path.splitext(file_path)[1]
+        self.file_extension = normalize_file_format(file_format) if file_format else os.path.splitext(file_path)[1]
         self.base_name = os.path.basename(self.file_name)
-        self.dir_name = os.path.dirname(os.path.realpath(self.file_path))
+        if self.parsed_file.in_memory:
+            self.dir_name = os.path.dirname(self.file_path)
+        else:
+            self.dir_name = os.path.dirname(os.path.realpath(self.file_path))
         self.base_name_dir = os.path.basename(self.dir_name)
         self.encoding_read_file = "ISO-8859-1"
         self.encoding_pd_read_csv = 'unicode_escape'
         self.encoding_open_file = 'utf8'
 
+    @timed("dataframe")
+    @parsed_file_cache
+    def load_matrix(self):
+        """
+        Reads the file (CSV, Excel, Parquet, Arrow or .npy) once and keeps it as ResistanceMatrix,
+        all methods of the class work on it.
+        Raises ValueError for other file formats and the error of pandas if the file can not be read.
+        """
+        if self.file_extension == '.csv':
+            df = pd.read_csv(self.parsed_file.bytes_io(), encoding=self.encoding_pd_read_csv)
+        elif self.file_extension == '.xlsx':
+            df = self.parsed_file.read_excel()
+        elif self.file_extension in COLUMNAR_FILE_FORMATS:
+            df = self.parsed_file.read_columnar(self.file_extension)
+        else:
+            raise ValueError("Unsupported file format. Only CSV, XLSX, Parquet, Arrow and .npy files are allowed.")
+        matrix = ResistanceMatrix.from_frame(df)
+        label(file_type="cyclic", rows=len(matrix))
+        return matrix
+
+    @timed("validation")
     def file_validation_temp(self):
         validity_status = {
             "Code": None,
@@ -26,17 +316,14 @@ class TemperatureFileProcessor:
             "Warning": None
         }
         
+        # Support both CSV and Excel files based on the file extension
+        if self.file_extension not in CYCLIC_FILE_FORMATS:
+            validity_status["Code"] = 400
+            validity_status["Message"] = "Unsupported file format. Only CSV, XLSX, Parquet, Arrow and .npy files are allowed."
+            validity_status["Warning"] = None
+            return validity_status
         try:
-            # Support both CSV and Excel files based on the file extension
-            if self.file_extension == '.csv':
-                df = pd.read_csv(self.file_path, encoding=self.encoding_pd_read_csv)
-            elif self.file_extension == '.xlsx':
-                df = pd.read_excel(self.file_path)
-            else:
-                validity_status["Code"] = 400
-                validity_status["Message"] = "Unsupported file format. Only CSV and XLSX files are allowed."
-                validity_status["Warning"] = None
-                return validity_status  
+            matrix = self.load_matrix()
         except Exception as e:
             validity_status["Code"] = 500
             validity_status["Message"] = f"Error reading file: {str(e)}"
@@ -44,13 +331,14 @@ class TemperatureFileProcessor:
             return validity_status
 
         # Validate file for having exactly 343 columns
-        if df.shape[1] == 343:
-            first_col = df.columns[0].strip().lower()
+        columns = matrix.columns
+        if len(columns) == 343:
+            first_col = columns[0].strip().lower()
             if first_col in ['t', 'temperature']:
                 for i in range(1, 343):
                     expected_col_1 = f"MA{i:03d}"  # Format MA001, MA002, ..., MA342
                     expected_col_2 = f"MA{i}"  # Format MA1, MA2, ..., MA342
-                    actual_col = df.columns[i].strip()
+                    actual_col = columns[i].strip()
                     if actual_col not in [expected_col_1, expected_col_2]:
                         validity_status["Code"] = 500
                         validity_status["Message"] = f"Column {i + 1} is not named '{expected_col_1}' or '{expected_col_2}', but '{actual_col}'."
@@ -65,11 +353,13 @@ class TemperatureFileProcessor:
                 validity_status["Warning"] = None
         else:
             validity_status["Code"] = 400
-            validity_status["Message"] = f"File has {df.shape[1]} columns, expected 343."
+            validity_status["Message"] = f"File has {len(columns)} columns, expected 343."
             validity_status["Warning"] = None
 
         return validity_status
         
+    @timed("aggregation")
+    @parsed_file_cache
     def find_min_max_resistance_in_MA(self):
         """
         Finds the minimum and maximum resistance values and their corresponding MA columns 
@@ -87,220 +377,153 @@ class TemperatureFileProcessor:
             "temperature_step": []
         }
     
+        if self.file_extension not in CYCLIC_FILE_FORMATS:
+            output["Error"] = "Unsupported file format."
+            return output  # Return the dictionary directly
         try:
-            # Read the file based on its extension
-            if self.file_extension == '.csv':
-                df = pd.read_csv(self.file_path, encoding=self.encoding_pd_read_csv)
-            elif self.file_extension == '.xlsx':
-                df = pd.read_excel(self.file_path)
-            else:
-                output["Error"] = "Unsupported file format."
-                return output  # Return the dictionary directly
+            matrix = self.load_matrix()
         except Exception as e:
             output["Error"] = f"Failed to load file: {str(e)}"
             return output  # Return the dictionary directly
     
         # Check if the temperature column exists
-        temp_column_name = None
-        for col in ['T', 'Temperature']:
-            if col in df.columns:
-                temp_column_name = col
-                break
-    
-        if temp_column_name is None:
+        if matrix.temp_column_name is None:
             output["Error"] = "Temperature column 'T' or 'Temperature' not found."
             return output  # Return the dictionary directly
     
-        # Drop the temperature column, keeping only resistance columns
-        resistance_columns = df.drop(columns=[temp_column_name]).fillna(0)
+        # Only the resistance columns, missing values count as 0
+        values = np.nan_to_num(matrix.values, nan=0.0, posinf=np.inf, neginf=-np.inf)
+        ma_columns = matrix.ma_columns
     
         # Find the absolute minimum and maximum resistance values
-        output["R_min"] = resistance_columns.min().min()
-        output["R_max"] = resistance_columns.max().max()
+        output["R_min"] = values.min()
+        output["R_max"] = values.max()
     
-        # Find the MA column for the absolute minimum and maximum resistance
-        absolute_min_MA = resistance_columns.stack().idxmin()[1]
-        absolute_max_MA = resistance_columns.stack().idxmax()[1]
-        output["absolute_min_MA_column"] = absolute_min_MA
-        output["absolute_max_MA_column"] = absolute_max_MA
+        # Find the MA column for the absolute minimum and maximum resistance (first one in row order)
+        output["absolute_min_MA_column"] = ma_columns[np.argmin(values) % values.shape[1]]
+        output["absolute_max_MA_column"] = ma_columns[np.argmax(values) % values.shape[1]]
     
         # Calculate the minimum and maximum for each temperature step (row-wise min/max)
-        df['Min_R_Per_Temp'] = resistance_columns.min(axis=1)
-        df['Max_R_Per_Temp'] = resistance_columns.max(axis=1)
-    
-        # Find the MA column for the min and max resistance per temperature
-        df['Min_MA_Column'] = resistance_columns.idxmin(axis=1)
-        df['Max_MA_Column'] = resistance_columns.idxmax(axis=1)
+        # together with the MA column where they are found
+        min_per_temp = values.min(axis=1).tolist()
+        max_per_temp = values.max(axis=1).tolist()
+        min_ma_column = [ma_columns[j] for j in np.argmin(values, axis=1).tolist()]
+        max_ma_column = [ma_columns[j] for j in np.argmax(values, axis=1).tolist()]
     
         # Add min and max resistance for each temperature step along with the MA column
-        for index, row in df.iterrows():
+        for i, temperature in enumerate(matrix.temperature.tolist()):
             output["temperature_step"].append({
-                "temperature": row[temp_column_name],
-                "R_min": row['Min_R_Per_Temp'],
-                "min_MA_column": row['Min_MA_Column'],
-                "R_max": row['Max_R_Per_Temp'],
-                "max_MA_column": row['Max_MA_Column']
+                "temperature": temperature,
+                "R_min": min_per_temp[i],
+                "min_MA_column": min_ma_column[i],
+                "R_max": max_per_temp[i],
+                "max_MA_column": max_ma_column[i]
             })
     
         # Return the output dictionary directly
         return output
 
+    @timed("serialization")
     def table_of_df_temp(self):
         try:
-            # Read the file (CSV or Excel)
-            if self.file_extension == '.csv':
-                df = pd.read_csv(self.file_path, encoding=self.encoding_pd_read_csv)
-            elif self.file_extension == '.xlsx':
-                df = pd.read_excel(self.file_path)
-            else:
-                return {"Error": "Unsupported file format."}  # Return a dictionary directly
-        except Exception as e:
-            return {"Error": f"Failed to load file: {str(e)}"}  # Return a dictionary directly
-
-        # Check if the temperature column exists
-        temp_column_name = None
-        for col in ['T', 'Temperature']:
-            if col in df.columns:
-                temp_column_name = col
-                break
+            data_table = self.iter_table_of_df_temp()
+        except ValueError as e:
+            return {"Error": str(e)}  # Return a dictionary directly
 
-        if temp_column_name is None:
-            return {"Error": "Temperature column 'T' or 'Temperature' not found."}
-
-        # Drop the temperature column, keeping only resistance columns
-        resistance_columns = df.drop(columns=[temp_column_name])
-
-        data_table = []
-
-        # Loop over each row and construct the dictionary
-        for index, row in df.iterrows():
-            temperature = row[temp_column_name]  # Extract the temperature
-            resistance_values = {}
+        # Return the final DataTable structure as JSON
+        return {"DataTable": list(data_table)}
 
-            # For each MA column, add it to the resistance_values dictionary
-            for col in resistance_columns.columns:
-                resistance_values[col] = row[col]
+    def iter_table_of_df_temp(self):
+        """
+        The entries of the DataTable of table_of_df_temp() one by one, e.g. to stream them.
+        Raises ValueError with the message of the "Error" of table_of_df_temp() if the file can not be loaded.
+        """
+        # Construct the final structure for each temperature from the whole matrix, with native Python values
+        return iter_data_table(self.table_matrix_temp())
 
-            # Construct the final structure for each temperature
-            data_table.append({
-                "temperature": temperature,
-                "R": resistance_values
-            })
+    def table_matrix_temp(self):
+        """
+        The ResistanceMatrix of the DataTable, e.g. to give it as Arrow or Parquet table.
+        Raises ValueError with the message of the "Error" of table_of_df_temp() if the file can not be loaded.
+        """
+        # Read the file (CSV or Excel)
+        if self.file_extension not in CYCLIC_FILE_FORMATS:
+            raise ValueError("Unsupported file format.")
+        try:
+            matrix = self.load_matrix()
+        except Exception as e:
+            raise ValueError(f"Failed to load file: {str(e)}")
 
-        # Return the final DataTable structure as JSON
-        return {"DataTable": data_table}
+        # Check if the temperature column exists
+        if matrix.temp_column_name is None:
+            raise ValueError("Temperature column 'T' or 'Temperature' not found.")
+        return matrix
 
-    def analyze_cycles_and_store_resistance_descriptions(self):
+    @timed("aggregation")
+    def resistance_descriptions(self):
+        """
+        The resistance of every temperature step and MA with its phase, cycle, name and comment as ResistanceDescriptions.
+        Returns a dictionary with "Error" if the file can not be loaded.
+        """
         try:
-            if self.file_extension == '.csv':
-                df = pd.read_csv(self.file_path, encoding=self.encoding_pd_read_csv)
-            elif self.file_extension == '.xlsx':
-                df = pd.read_excel(self.file_path)
-            else:
-                raise ValueError("Unsupported file format. Only CSV and XLSX files are allowed.")
+            matrix = self.load_matrix()
         except Exception as e:
             return {"Error": f"Failed to load file: {str(e)}"}
+        return ResistanceDescriptions(matrix)
 
-        df['Heating/Cooling'] = ''
-        df['Cycle'] = 1
-        cycle_count = 1
-        previous_temp = df['T'].iloc[0]
-        is_heating = True if df['T'].iloc[1] > previous_temp else False
-        df.at[0, 'Heating/Cooling'] = 'heating' if is_heating else 'cooling'
-
-        for i in range(1, len(df)):
-            current_temp = df['T'].iloc[i]
-            if current_temp > previous_temp:
-                if not is_heating:
-                    cycle_count += 1
-                df.at[i, 'Heating/Cooling'] = 'heating'
-                is_heating = True
-            elif current_temp < previous_temp:
-                if is_heating:
-                    cycle_count += 1
-                df.at[i, 'Heating/Cooling'] = 'cooling'
-                is_heating = False
-            else:
-                df.at[i, 'Heating/Cooling'] = df['Heating/Cooling'].iloc[i - 1]
-
-            df.at[i, 'Cycle'] = cycle_count
-            previous_temp = current_temp
-
-        total_cycles = df['Cycle'].max()
-        resistance_data = []
-        ma_columns = [col for col in df.columns if col.startswith('MA')]
-
-        for i in range(len(df)):
-            temperature = df['T'].iloc[i]
-            phase = df['Heating/Cooling'].iloc[i]
-            cycle = df['Cycle'].iloc[i]
-
-            for col in ma_columns:
-                resistance_value = df[col].iloc[i]
-
-                if total_cycles > 1:
-                    comment = f"R{temperature}_{phase}_cycle_{cycle}"
-                    data_name = f"R{temperature}_{phase}{cycle}"
-                else:
-                    comment = f"R{temperature}_{phase}"
-                    data_name = f"R{temperature}_{phase}"
-
-                resistance_data.append({
-                    "measurement_area": int(col[2:]),
-                    "R": resistance_value,
-                    "temperature": int(temperature),
-                    "phase": phase,
-                    "cycle": int(cycle),
-                    "comment": comment,
-                    "data_name": data_name
-                })
+    def analyze_cycles_and_store_resistance_descriptions(self):
+        descriptions = self.resistance_descriptions()
+        if isinstance(descriptions, dict):
+            return descriptions
+        return list(descriptions.records())
 
-        return resistance_data
+    def analyze_all(self):
+        """
+        Everything that is computed for a cyclic temperature file from one load of the file:
+            "validation" --> file_validation_temp()
+            "table" --> table_of_df_temp()
+            "extrema" --> find_min_max_resistance_in_MA()
+            "database" --> info_R_in_MA_for_database_temp()
+            "overall" --> info_for_database_temp()
+        """
+        return {
+            "validation": self.file_validation_temp(),
+            "table": self.table_of_df_temp(),
+            "extrema": self.find_min_max_resistance_in_MA(),
+            "database": self.info_R_in_MA_for_database_temp(),
+            "overall": self.info_for_database_temp(),
+        }
 
+    @timed("aggregation")
     def info_R_in_MA_for_database_temp(self):
         try:
-            resistance_data = self.analyze_cycles_and_store_resistance_descriptions()
+            descriptions = self.resistance_descriptions()
         except Exception as e:
             return {"Error": f"Failed to analyze resistance data: {str(e)}"}
+        if isinstance(descriptions, dict):
+            return descriptions
 
         final_output = {
-            "compositionsForSampleUpdate": []
+            "compositionsForSampleUpdate": list(descriptions.compositions())
         }
 
-        for data in resistance_data:
-            measurement_area = data['measurement_area']
-            resistance_value = data['R']
-
-            composition = {
-                "predicate": {
-                    "properties": [
-                        {
-                            "Type": 2,
-                            "Name": "Measurement Area",
-                            "Value": measurement_area
-                        }
-                    ]
-                },
-                "deletePreviousProperties": False,
-                "properties": [
-                    {
-                        "PropertyId": 0,
-                        "Type": 1,
-                        "Name": data['data_name'],
-                        "Value": float(resistance_value),
-                        "ValueEpsilon": None,
-                        "SortCode": 10,
-                        "Row": None,
-                        "Comment": data['comment']
-                    }
-                ]
-            }
-
-            final_output["compositionsForSampleUpdate"].append(composition)
-
         return final_output
 
+    def stream_info_R_in_MA_for_database_temp(self):
+        """
+        The JSON text of info_R_in_MA_for_database_temp() in chunks, written directly from the columns
+        without creating the dictionaries of the compositions. Errors of the analysis are returned as one chunk.
+        Raises ValueError if a resistance is NaN or infinite, which can not be written as JSON.
+        """
+        try:
+            descriptions = self.resistance_descriptions()
+        except Exception as e:
+            return iter([json.dumps({"Error": f"Failed to analyze resistance data: {str(e)}"}, ensure_ascii=False)])
+        if isinstance(descriptions, dict):
+            return iter([json.dumps(descriptions, ensure_ascii=False)])
+        return descriptions.iter_compositions_json()
 
+    @timed("aggregation")
     def info_for_database_temp(self):
         """
         Generates a JSON structure with the resistance data for database storage.
@@ -0,0 +1,89 @@
+import asyncio
+import concurrent.futures
+import functools
+import importlib
+import multiprocessing
+import os
+import threading
+
+# Modules which are imported in every worker before it takes the first task
+WARM_MODULES = ["numpy", "pandas", "serializers", "parsed_file", "sniffer", "table_reader",
+                "cyclic_temperature_dependent", "Data_validation_and_classification_MA", "processing"]
+
+
+def warm_up_worker(initializer=None, initargs=()):
+    """Imports WARM_MODULES in a worker process and calls initializer(*initargs), e.g. to set up logging."""
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _ready():
+    return os.getpid()
+
+
+class WorkerPool:
+    """
+    Executor for the CPU-bound processing of files, so the event loop keeps accepting and streaming requests.
+
+    kind "process": a process pool (started with start_method) whose workers have pandas and the modules of
+    the project already imported, the functions and their arguments and results have to be picklable.
+    kind "thread": a thread pool, e.g. for debugging or if the work releases the GIL.
+    run_in_thread() always uses threads, for functions whose results can not leave the process (iterators).
+
+    The pool is started by start() or by the first run(), all workers are started at once.
+    """
+
+    def __init__(self, kind="process", max_workers=None, start_method="spawn", initializer=None, initargs=()):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"kind must be 'process' or 'thread', not {kind!r}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.start_method = start_method
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+        self._threads = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the workers and waits until each of them has imported the modules."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._threads = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="resistance")
+            if self.kind == "thread":
+                self._executor = self._threads
+                return
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=warm_up_worker,
+                initargs=(self.initializer, self.initargs),
+            )
+            # ProcessPoolExecutor starts the workers only when tasks are waiting: one task per worker starts them all
+            for future in [executor.submit(_ready) for _ in range(self.max_workers)]:
+                future.result()
+            self._executor = executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                if self._threads is not self._executor:
+                    self._threads.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._threads = None
+
+    async def run(self, func, *args, **kwargs):
+        """await func(*args, **kwargs) in a worker of the pool."""
+        if self._executor is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run_in_thread(self, func, *args, **kwargs):
+        """await func(*args, **kwargs) in a thread of the pool, also if the pool has processes."""
+        if self._executor is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return await asyncio.get_running_loop().run_in_executor(self._threads, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import zlib
+
+from metrics import stage
+
+# zstandard is only needed to accept zstd compressed bodies
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies up to this size are kept in memory, larger bodies are written to a spool file while they are received
+SPOOL_MEMORY_BYTES = 8 * 1024 * 1024
+# Largest body (after decompression) that is accepted, it guards against decompression bombs
+MAX_BODY_BYTES = 1024 * 1024 * 1024
+# Largest piece of decompressed data that is produced at once
+DECODE_CHUNK_BYTES = 256 * 1024
+# Size of the pieces of compressed input that are given to the zstd decompressor at once
+ZSTD_INPUT_BYTES = 1024
+# The received chunks are collected to batches of about this size, which are decompressed, hashed and written
+# in a thread while the next batch is received
+RECEIVE_BATCH_BYTES = 1024 * 1024
+
+# The first bytes of compressed bodies that are sent without Content-Encoding
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class BodyTooLarge(ValueError):
+    """The body, after decompression, is larger than the allowed size."""
+
+
+class BodyEncodingError(ValueError):
+    """The Content-Encoding of the body is not supported or the compressed body is damaged."""
+
+    def __init__(self, message, unsupported=False):
+        super().__init__(message)
+        self.unsupported = unsupported
+
+
+class SpooledBody:
+    """
+    A request body that was written to a spool file. Only the path is pickled, so the body is passed to
+    the worker processes without copying its content through the pipe; the worker reads the file itself.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+
+class ReceivedBody:
+    """
+    The body of a request as received by receive_body():
+        sha256 --> hex digest of the (decompressed) body, computed while it was received
+        size --> number of bytes of the (decompressed) body
+        data --> the body as bytes, or as SpooledBody if it was larger than the memory limit
+        encoding --> the compression of the body as it was sent ("gzip", "zstd") or None
+    close() removes the spool file.
+    """
+
+    def __init__(self, sha256, size, data, encoding=None):
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.encoding = encoding
+
+    @property
+    def spooled(self):
+        return isinstance(self.data, SpooledBody)
+
+    def close(self):
+        if self.spooled:
+            try:
+                os.remove(self.data.path)
+            except FileNotFoundError:
+                pass
+
+
+class _BodyWriter:
+    ## hashes, counts and keeps the (decompressed) body, in memory or in a spool file
+    def __init__(self, max_memory, max_size, spool_dir):
+        self.max_memory = max_memory
+        self.max_size = max_size
+        self.spool_dir = spool_dir
+        self.digest = hashlib.sha256()
+        self.chunks = []
+        self.size = 0
+        self.spool = None
+
+    def write(self, data):
+        if not data:
+            return 0
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise BodyTooLarge(f"The body is larger than {self.max_size} bytes")
+        self.digest.update(data)
+        if self.spool is None and self.size <= self.max_memory:
+            self.chunks.append(bytes(data))
+            return len(data)
+        with stage("temp_file_write"):
+            if self.spool is None:
+                self.spool = tempfile.NamedTemporaryFile(prefix="resistance-body-", dir=self.spool_dir, delete=False)
+                self.spool.writelines(self.chunks)
+                self.chunks = None
+            self.spool.write(data)
+        return len(data)
+
+    def finish(self, encoding):
+        if self.spool is None:
+            return ReceivedBody(self.digest.hexdigest(), self.size, b"".join(self.chunks), encoding)
+        self.spool.close()
+        return ReceivedBody(self.digest.hexdigest(), self.size, SpooledBody(self.spool.name, self.size), encoding)
+
+    def discard(self):
+        if self.spool is not None:
+            self.spool.close()
+            os.remove(self.spool.name)
+
+
+class _GzipDecoder:
+    ## streaming gzip decompression into a _BodyWriter, also of bodies with several gzip members
+    def __init__(self, writer):
+        self.writer = writer
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        try:
+            while data:
+                if self.decompressor.eof:
+                    self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                # max_length keeps each piece small, however much a few compressed bytes expand
+                self.writer.write(self.decompressor.decompress(data, DECODE_CHUNK_BYTES))
+                ## after the end of a member the rest of the input is only in unused_data
+                data = self.decompressor.unused_data if self.decompressor.eof else self.decompressor.unconsumed_tail
+        except zlib.error as e:
+            raise BodyEncodingError(f"The gzip compressed body is damaged: {e}")
+
+    def close(self):
+        ## output that max_length held back after the last input
+        while not self.decompressor.eof:
+            data = self.decompressor.decompress(b"", DECODE_CHUNK_BYTES)
+            if not data:
+                raise BodyEncodingError("The gzip compressed body is incomplete")
+            self.writer.write(data)
+
+
+class _ZstdDecoder:
+    ## streaming zstd decompression into a _BodyWriter, also of bodies with several zstd frames
+    def __init__(self, writer):
+        if zstandard is None:
+            raise BodyEncodingError("zstd compressed bodies are not supported, zstandard is not installed", unsupported=True)
+        self.writer = writer
+        self.decompressor = self._decompressor()
+
+    @staticmethod
+    def _decompressor():
+        return zstandard.ZstdDecompressor().decompressobj(write_size=DECODE_CHUNK_BYTES)
+
+    def write(self, data):
+        data = memoryview(data)
+        try:
+            # the decompressor has no output limit: the input is given in small pieces, each of them
+            # expands to at most 32 MiB (one byte per RLE block of 128 KiB)
+            for start in range(0, len(data), ZSTD_INPUT_BYTES):
+                piece = bytes(data[start:start + ZSTD_INPUT_BYTES])
+                while piece:
+                    if self.decompressor.eof:
+                        self.decompressor = self._decompressor()
+                    self.writer.write(self.decompressor.decompress(piece))
+                    piece = self.decompressor.unused_data if self.decompressor.eof else b""
+        except zstandard.ZstdError as e:
+            raise BodyEncodingError(f"The zstd compressed body is damaged: {e}")
+
+    def close(self):
+        if not self.decompressor.eof:
+            raise BodyEncodingError("The zstd compressed body is incomplete")
+
+
+DECODERS = {
+    "gzip": _GzipDecoder,
+    "x-gzip": _GzipDecoder,
+    "zstd": _ZstdDecoder,
+}
+
+
+def content_encoding(header):
+    """The compression of a Content-Encoding header ("gzip", "zstd"), None for identity or no header."""
+    codings = [coding.strip().lower() for coding in (header or "").split(",")]
+    codings = [coding for coding in codings if coding and coding != "identity"]
+    if not codings:
+        return None
+    if len(codings) > 1 or codings[0] not in DECODERS:
+        raise BodyEncodingError(f"Content-Encoding {header!r} is not supported, use gzip or zstd", unsupported=True)
+    return "gzip" if codings[0] == "x-gzip" else codings[0]
+
+
+def _write_batch(sink, chunks):
+    for chunk in chunks:
+        sink.write(chunk)
+
+
+def _write_last_batch(sink, writer, chunks, encoding):
+    _write_batch(sink, chunks)
+    if sink is not writer:
+        sink.close()
+    return writer.finish(encoding)
+
+
+def sniff_encoding(prefix):
+    """The compression of a body that starts with prefix, recognised by its magic number, None if it is not compressed."""
+    if prefix.startswith(GZIP_MAGIC):
+        return "gzip"
+    if prefix.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+async def receive_body(request, max_memory=SPOOL_MEMORY_BYTES, spool_dir=None, max_size=MAX_BODY_BYTES):
+    """
+    Reads the body of a starlette Request chunk by chunk from request.stream() and hashes it on the way.
+    The chunks are kept in memory until they exceed max_memory bytes, then everything is written to a
+    spool file in spool_dir (the temporary directory by default) and the following chunks are appended to it,
+    so a request holds at most max_memory bytes of its body in memory, however large the file is.
+    Only the chunks are received on the event loop: they are decompressed, hashed and written in batches of
+    RECEIVE_BATCH_BYTES in a thread, one batch while the next one is received.
+
+    A body with Content-Encoding gzip or zstd, or without Content-Encoding but starting with the gzip or zstd
+    magic number, is decompressed while it is received; the hash, the size and the data are those of the
+    decompressed body. Raises BodyTooLarge if the (decompressed) body has more than max_size bytes
+    and BodyEncodingError if the encoding is not supported or the compressed body is damaged.
+    """
+    encoding = content_encoding(request.headers.get("content-encoding"))
+    sniff = encoding is None
+    writer = _BodyWriter(max_memory, max_size, spool_dir)
+    sink = writer if encoding is None else DECODERS[encoding](writer)
+    prefix = b""
+    batch = []
+    batch_size = 0
+    ## the batch that is written in a thread, it is shielded: a cancelled request waits for the thread below
+    pending = None
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if sniff:
+                ## the first bytes are held back until the magic number can be recognised
+                prefix += chunk
+                if len(prefix) < len(ZSTD_MAGIC):
+                    continue
+                sniff = False
+                encoding = sniff_encoding(prefix)
+                if encoding is not None:
+                    sink = DECODERS[encoding](writer)
+                chunk, prefix = prefix, b""
+            batch.append(chunk)
+            batch_size += len(chunk)
+            if batch_size >= RECEIVE_BATCH_BYTES:
+                if pending is not None:
+                    await asyncio.shield(pending)
+                pending = asyncio.ensure_future(asyncio.to_thread(_write_batch, sink, batch))
+                batch = []
+                batch_size = 0
+        if prefix:
+            batch.append(prefix)
+        if pending is not None:
+            await asyncio.shield(pending)
+        pending = asyncio.ensure_future(asyncio.to_thread(_write_last_batch, sink, writer, batch, encoding))
+        return await asyncio.shield(pending)
+    except BaseException:
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        writer.discard()
+        raise
@@ -0,0 +1,281 @@
+"""
+Jobs for files that take longer to process than a client (or a gateway) waits for a response.
+
+A job is submitted with the uploaded file and returns its id at once; the file is processed later in the
+worker pool and the client polls the status, stage and progress of the job and fetches the result when it is done.
+Everything is kept locally in one directory: the SQLite database of the jobs (which is also the queue),
+the uploaded files (<id>.input) and the results (<id>.result).
+
+Job kinds:
+    "analyze" --> processing.analyze, params: file_format, outputs
+    "table" --> processing.data_table, params: file_format, table_format (None, "arrow" or "parquet")
+Status: "queued" --> "running" --> "done" or "failed". The stage of a running job is "starting", the output
+that is being computed ("validation", "table", "database", "overall") or "writing".
+
+The finished jobs are kept for ttl seconds, at most max_jobs of them and at most max_bytes of results;
+the oldest finished jobs are removed first.
+"""
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+import processing
+from ingest import SpooledBody
+
+JOB_KINDS = ("analyze", "table")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner INTEGER,
+    input_size INTEGER NOT NULL,
+    media_type TEXT,
+    result_size INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+# Columns of a job that are given to the clients
+_PUBLIC_COLUMNS = ("id", "kind", "status", "stage", "progress", "created", "started", "finished", "input_size",
+                   "media_type", "result_size", "error")
+
+
+class JobStore:
+    """
+    The jobs in a directory: the SQLite database jobs.sqlite3 and the input and result file of each job.
+    The store can be used from several threads and processes, every call opens its own connection.
+    """
+
+    def __init__(self, directory, max_jobs=100, max_bytes=2 * 1024 * 1024 * 1024, ttl=24 * 3600.0):
+        self.directory = directory
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.db_path = os.path.join(directory, "jobs.sqlite3")
+
+    def initialize(self):
+        """Creates the directory and the database, and queues again the jobs of server processes that have stopped."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            running = db.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall()
+            for job_id, owner in running:
+                if not _process_alive(owner):
+                    db.execute("UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, started = NULL, "
+                               "owner = NULL WHERE id = ?", (job_id,))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        ## one transaction on a new connection, committed (or rolled back) and closed at the end
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def input_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.input")
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.result")
+
+    def submit(self, data, kind, params):
+        """
+        Queues a job for the content of a file (bytes or SpooledBody, a spool file is moved into the directory)
+        and returns its id.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"kind must be one of {JOB_KINDS}, not {kind!r}")
+        job_id = uuid.uuid4().hex
+        if isinstance(data, SpooledBody):
+            shutil.move(data.path, self.input_path(job_id))
+        else:
+            with open(self.input_path(job_id), "wb") as f:
+                f.write(data)
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, kind, params, status, stage, created, input_size) "
+                       "VALUES (?, ?, ?, 'queued', 'queued', ?, ?)",
+                       (job_id, kind, json.dumps(params), time.time(), len(data)))
+        return job_id
+
+    def get(self, job_id):
+        """The public columns of a job as dictionary, None if there is no such job."""
+        with self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(_PUBLIC_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else dict(zip(_PUBLIC_COLUMNS, row))
+
+    def params(self, job_id):
+        with self._connect() as db:
+            kind, params = db.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return kind, json.loads(params)
+
+    def update(self, job_id, **values):
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in values)} WHERE id = ?",
+                       (*values.values(), job_id))
+
+    def claim_next(self):
+        """Marks the oldest queued job as running by this process and returns its id, None if no job is queued."""
+        with self._connect() as db:
+            row = db.execute("UPDATE jobs SET status = 'running', stage = 'starting', started = ?, owner = ? "
+                             "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1) "
+                             "RETURNING id", (time.time(), os.getpid())).fetchone()
+        return None if row is None else row[0]
+
+    def delete(self, job_id):
+        """Removes a job that is not running with its files. Returns False if there is no such job or it is running."""
+        with self._connect() as db:
+            deleted = db.execute("DELETE FROM jobs WHERE id = ? AND status != 'running'", (job_id,)).rowcount
+        if deleted:
+            self._remove_files(job_id)
+        return bool(deleted)
+
+    def _remove_files(self, job_id):
+        for path in (self.input_path(job_id), self.result_path(job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def purge(self, now=None):
+        """Removes the finished jobs that are older than ttl or exceed max_jobs / max_bytes, the oldest first."""
+        now = time.time() if now is None else now
+        with self._connect() as db:
+            finished = db.execute("SELECT id, finished, COALESCE(result_size, 0) FROM jobs "
+                                  "WHERE status IN ('done', 'failed') ORDER BY finished DESC").fetchall()
+        kept = total = 0
+        expired = []
+        for job_id, finished_at, size in finished:
+            if finished_at < now - self.ttl or kept >= self.max_jobs or total + size > self.max_bytes:
+                expired.append(job_id)
+            else:
+                kept += 1
+                total += size
+        for job_id in expired:
+            self.delete(job_id)
+        return len(expired)
+
+
+def _process_alive(pid):
+    ## the jobs of this process are not running yet when the store is initialized
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_job(store, job_id):
+    """
+    Processes a claimed job and stores its result, in a worker of the pool. The stage and the progress
+    are written to the database while the job runs, errors mark the job as failed.
+    """
+    try:
+        kind, params = store.params(job_id)
+        data = SpooledBody(store.input_path(job_id), os.path.getsize(store.input_path(job_id)))
+
+        def progress(stage, done, total):
+            store.update(job_id, stage=stage, progress=done / total)
+
+        if kind == "analyze":
+            result = processing.analyze(data, params.get("file_format"), params["outputs"], progress=progress)
+        else:
+            progress("table", 0, 1)
+            result = processing.data_table(data, params.get("file_format"), params.get("table_format"))
+
+        store.update(job_id, stage="writing")
+        path = store.result_path(job_id)
+        with open(path + ".tmp", "wb") as f:
+            f.write(result.body)
+        os.replace(path + ".tmp", path)
+        store.update(job_id, status="done", stage="done", progress=1.0, finished=time.time(),
+                     media_type=result.media_type, result_size=os.path.getsize(path))
+    except Exception as e:
+        processing.logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+        store.update(job_id, status="failed", stage="failed", finished=time.time(), error=str(e))
+    finally:
+        try:
+            os.remove(store.input_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class JobRunner:
+    """
+    Runs the queued jobs of a JobStore, at most concurrency at the same time, with run(func, *args)
+    (e.g. WorkerPool.run) and removes the expired jobs every purge_interval seconds.
+    wake() is called when a job was submitted.
+    """
+
+    def __init__(self, store, run, concurrency=1, purge_interval=60.0):
+        self.store = store
+        self.run = run
+        self.concurrency = concurrency
+        self.purge_interval = purge_interval
+        self._event = asyncio.Event()
+        self._running = set()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, *self._running, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        self._event.set()
+
+    async def _dispatch(self):
+        last_purge = 0.0
+        while True:
+            self._event.clear()
+            try:
+                if time.monotonic() - last_purge >= self.purge_interval:
+                    await asyncio.to_thread(self.store.purge)
+                    last_purge = time.monotonic()
+                while len(self._running) < self.concurrency:
+                    job_id = await asyncio.to_thread(self.store.claim_next)
+                    if job_id is None:
+                        break
+                    task = asyncio.create_task(self._run_job(job_id))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            except Exception as e:
+                processing.logger.error(f"Error in the job queue: {str(e)}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout=self.purge_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job_id):
+        try:
+            await self.run(run_job, self.store, job_id)
+        except Exception as e:
+            # e.g. the worker process died, the job can not report it itself
+            await asyncio.to_thread(self.store.update, job_id, status="failed", stage="failed",
+                                    finished=time.time(), error=f"The job could not be run: {str(e)}")
+        finally:
+            self.wake()
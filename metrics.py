@@ -0,0 +1,211 @@
+"""
+Timing of the stages of the processing of a request, exported as Prometheus histograms (/metrics) and in the
+Server-Timing header of the responses.
+
+Stages (the time of a stage does not include the stages that run inside it):
+    "body_read" --> receiving (and decompressing) the request body
+    "temp_file_write" --> writing a large body to its spool file
+    "detect_type" --> magic.from_buffer / the magic number of the columnar formats
+    "sniff" --> find_type_and_keyword()
+    "columns" --> column inference: skiprows, column names, measurement type
+    "dataframe" --> building the DataFrame / ResistanceMatrix of the file
+    "validation" --> file_validation() / file_validation_temp()
+    "aggregation" --> extrema of the MAs, database values, cycle analysis
+    "serialization" --> DataTable records, JSON, Arrow and Parquet output
+
+The stages of the worker processes are timed by timed_call() and sent back with the result, record()
+adds them to the timings of the request. Labels of the histograms: the route, the type of the file ("RT",
+"T_dependent", "cyclic", "other", "unknown" if it was not detected), its size and its number of rows as
+classes (e.g. "<=1MiB", "<=10k"). Each server process has its own histograms.
+"""
+import bisect
+import contextlib
+import contextvars
+import functools
+import time
+
+# prometheus_client is only needed for /metrics, the Server-Timing header works without it
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# Upper bounds of the classes of the file size and of the number of rows, the last class is open
+FILE_SIZE_CLASSES = ((100 * 1024, "<=100KiB"), (1024 * 1024, "<=1MiB"), (10 * 1024 * 1024, "<=10MiB"),
+                     (100 * 1024 * 1024, "<=100MiB"))
+ROW_CLASSES = ((1000, "<=1k"), (10_000, "<=10k"), (100_000, "<=100k"), (1_000_000, "<=1M"))
+
+# Buckets of the histograms in seconds, the large cyclic files take minutes
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_LABELS = ("route", "file_type", "file_size", "rows")
+
+if prometheus_client is not None:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "resistance_stage_seconds", "Time of a stage of the processing of a request",
+        ("stage",) + _LABELS, buckets=BUCKETS,
+    )
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        "resistance_request_seconds", "Time of a request until its response is sent completely",
+        ("status",) + _LABELS, buckets=BUCKETS,
+    )
+    CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+else:
+    STAGE_SECONDS = REQUEST_SECONDS = None
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current = contextvars.ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """The seconds of each stage and the labels (file_type, file_size, rows) of one request or one worker call."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.labels = {}
+        ## seconds of the stages that run inside each of the open stages
+        self._nested = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def label(self, **values):
+        ## a label that gets different values (e.g. for the files of a batch) is "mixed"
+        for key, value in values.items():
+            if self.labels.get(key, value) != value:
+                value = "mixed"
+            self.labels[key] = value
+
+    def server_timing(self, total):
+        """The value of the Server-Timing header, durations in milliseconds."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.seconds.items()]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def stage(name):
+    """Context manager that times a stage for the current request, it does nothing outside of a request."""
+    timings = _current.get()
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.stage(name)
+
+
+def timed(name):
+    """Decorator that times every call of a function as stage name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def label(**values):
+    """Sets labels of the current request: file_type, file_size (bytes) and rows."""
+    timings = _current.get()
+    if timings is not None:
+        timings.label(**values)
+
+
+def timed_call(func, *args, **kwargs):
+    """
+    func(*args, **kwargs) with new StageTimings, e.g. in a worker process.
+    Returns (result, seconds of the stages, labels), record() adds them to the timings of the request.
+    """
+    timings = StageTimings()
+    token = _current.set(timings)
+    try:
+        return func(*args, **kwargs), timings.seconds, timings.labels
+    finally:
+        _current.reset(token)
+
+
+def record(seconds, labels):
+    """Adds the stages and labels of a timed_call() to the current request."""
+    timings = _current.get()
+    if timings is not None:
+        for name, value in seconds.items():
+            timings.add(name, value)
+        timings.label(**labels)
+
+
+def _value_class(value, classes):
+    if not isinstance(value, int):
+        return value or "unknown"
+    index = bisect.bisect_left([bound for bound, _ in classes], value)
+    return classes[index][1] if index < len(classes) else ">" + classes[-1][1][2:]
+
+
+def label_values(route, labels):
+    """The label values of the histograms for the labels of a request."""
+    return {
+        "route": route,
+        "file_type": labels.get("file_type") or "unknown",
+        "file_size": _value_class(labels.get("file_size"), FILE_SIZE_CLASSES),
+        "rows": _value_class(labels.get("rows"), ROW_CLASSES),
+    }
+
+
+def observe(route, status, timings, total):
+    if REQUEST_SECONDS is None:
+        return
+    values = label_values(route, timings.labels)
+    for name, seconds in timings.seconds.items():
+        STAGE_SECONDS.labels(stage=name, **values).observe(seconds)
+    REQUEST_SECONDS.labels(status=str(status), **values).observe(total)
+
+
+def latest():
+    """The metrics of this process in the Prometheus text format."""
+    return prometheus_client.generate_latest()
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times the stages of each HTTP request: the Server-Timing header of the response
+    has the stages that are done when the response starts, the histograms get all stages and the total time
+    when the response is complete. Requests to skip_paths and to unknown paths are not observed.
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        timings = StageTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = timings.server_timing(time.perf_counter() - start).encode()
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            if route is not None:
+                observe(route.path, status, timings, time.perf_counter() - start)
@@ -0,0 +1,172 @@
+import codecs
+import functools
+import io
+import os
+import threading
+
+import pandas as pd
+
+from metrics import timed
+from table_reader import read_columnar_table
+
+# The Rust based calamine reader loads .xlsx sheets many times faster than openpyxl and gives the same
+# DataFrame. It is used if python-calamine is installed, otherwise the read-only openpyxl reader of pandas.
+try:
+    import python_calamine  # noqa: F401
+    XLSX_ENGINE = "calamine"
+except ImportError:
+    XLSX_ENGINE = "openpyxl"
+
+
+class ParsedFile:
+    """
+    Parsed-file artifact shared by all methods of one data_file (or TemperatureFileProcessor) instance.
+
+    The raw bytes of the file are read from disk only once. Everything derived from them
+    (decoded text, sniff result, skiprows, column names, measurement type, loaded DataFrame, ...)
+    is computed lazily the first time it is requested and then kept, so the methods that call each
+    other do not open and scan the same file again and again.
+    The cached values are dropped as soon as the mtime or the size of the file changes.
+    The artifact can be used from several threads; one lock protects the raw bytes and the values.
+
+    Instead of a path the content of the file can be given directly as bytes, bytearray, memoryview
+    or a binary file-like object, then nothing is written to or read from the disk.
+    """
+
+    def __init__(self, source):
+        self._lock = threading.RLock()
+        self._signature = None
+        self._raw = None
+        self._stream = None
+        self._values = {}
+        self.file_path = None
+        if isinstance(source, (str, os.PathLike)):
+            self.file_path = source
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            self._raw = bytes(source)
+        elif hasattr(source, 'read'):
+            self._stream = source
+        else:
+            raise TypeError(f"Expected a path, bytes, memoryview or a binary file-like object, not {type(source).__name__}")
+
+    @property
+    def in_memory(self):
+        """True if the content was given directly and not as the path of a file."""
+        return self.file_path is None
+
+    def _check_signature(self):
+        """Drops everything that has been read or computed if the file on disk has been changed."""
+        if self.file_path is None:
+            return
+        stat = os.stat(self.file_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            self._signature = signature
+            self._raw = None
+            self._values = {}
+
+    def raw(self):
+        """The content of the file as bytes."""
+        with self._lock:
+            self._check_signature()
+            if self._raw is None:
+                if self._stream is not None:
+                    if self._stream.seekable():
+                        self._stream.seek(0)
+                    self._raw = self._stream.read()
+                else:
+                    with open(self.file_path, 'rb') as f:
+                        self._raw = f.read()
+            return self._raw
+
+    def text(self, encoding):
+        """
+        The content of the file decoded with the given encoding. Line endings are translated to "\\n"
+        in the same way as open(file_path, 'r', encoding=encoding) does it, so iterating over
+        io.StringIO(text) gives the same lines as iterating over the opened file.
+        """
+        def decode():
+            text = self.raw().decode(encoding)
+            return text.replace('\r\n', '\n').replace('\r', '\n')
+        return self.get(('text', encoding), decode)
+
+    def size(self):
+        """The size of the file in bytes."""
+        with self._lock:
+            self._check_signature()
+            if self._raw is not None:
+                return len(self._raw)
+            if self.file_path is not None:
+                return self._signature[1]
+            if self._stream.seekable():
+                return self._stream.seek(0, io.SEEK_END)
+            return len(self.raw())
+
+    def raw_prefix(self, size):
+        """The first size bytes of the file. The rest of the file is not read, if it has not been read before."""
+        with self._lock:
+            self._check_signature()
+            if self._raw is not None:
+                return self._raw[:size]
+            if self.file_path is not None:
+                with open(self.file_path, 'rb') as f:
+                    return f.read(size)
+            if self._stream.seekable():
+                self._stream.seek(0)
+                return self._stream.read(size)
+            return self.raw()[:size]
+
+    def text_prefix(self, encoding, size):
+        """
+        The complete lines within the first size bytes of the file, decoded like text().
+        For files which are not larger than size this is the whole text.
+        """
+        def decode():
+            if self.size() <= size:
+                return self.text(encoding)
+            text = codecs.getincrementaldecoder(encoding)().decode(self.raw_prefix(size))
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+            return text[:text.rfind('\n') + 1]
+        return self.get(('text_prefix', encoding, size), decode)
+
+    def bytes_io(self):
+        """A new binary buffer over the content of the file, e.g. for pd.read_csv or pd.read_excel."""
+        return io.BytesIO(self.raw())
+
+    @timed("dataframe")
+    def read_excel(self):
+        """The first sheet of an .xlsx file with typed columns, read only once with XLSX_ENGINE."""
+        return self.get('read_excel', lambda: pd.read_excel(self.bytes_io(), engine=XLSX_ENGINE))
+
+    @timed("dataframe")
+    def read_columnar(self, file_format):
+        """The table of a Parquet, Arrow IPC or .npy file (table_reader.COLUMNAR_FILE_FORMATS), read only once."""
+        return self.get(('read_columnar', file_format), lambda: read_columnar_table(self.raw(), file_format))
+
+    def get(self, key, compute):
+        """
+        Returns the value stored under key, calling compute() to create it the first time.
+        The stored value itself is returned and shared by all callers, a caller that modifies
+        a list, dictionary or DataFrame works on its own copy (e.g. df.copy()).
+        """
+        with self._lock:
+            self._check_signature()
+            if key not in self._values:
+                self._values[key] = compute()
+            return self._values[key]
+
+
+def normalize_file_format(file_format):
+    """The file format as extension with a leading dot in lower case, e.g. "CSV" --> ".csv"."""
+    return '.' + file_format.lower().lstrip('.')
+
+
+def parsed_file_cache(method):
+    """
+    Decorator for methods without arguments of classes that have a parsed_file attribute:
+    the result of the method is computed once and then taken from the parsed-file artifact.
+    """
+    @functools.wraps(method)
+    def wrapper(self):
+        return self.parsed_file.get(method.__qualname__, lambda: method(self))
+    return wrapper
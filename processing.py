@@ -0,0 +1,331 @@
+"""
+The processing of an uploaded file for the routes of FastAPI_Resistance_validation.
+
+The functions are defined at module level and take and return only picklable values (the content of
+the file as bytes or SpooledBody, Result with the rendered body), so the routes can run them in worker processes.
+Only the streamed DataTable (data_table_stream) returns an iterator and has to run in a thread.
+"""
+import collections
+import logging
+import os
+
+import magic
+
+from Data_validation_and_classification_MA import data_file
+from ingest import MAX_BODY_BYTES, BodyTooLarge, SpooledBody
+from metrics import label, timed
+from structured_logging import log_payload, log_to_queue, set_payload_sampling
+from table_reader import COLUMNAR_FILE_FORMATS, columnar_file_format
+from serializers import (ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE, arrow_table, dumps, iter_json_document,
+                         iter_ndjson, to_arrow_ipc, to_parquet)
+
+logger = logging.getLogger("execution_logger")
+
+# Map detected file type to appropriate extensions, the fallback is .csv if the type is unknown
+EXTENSION_MAP = {
+    "text/csv": ".csv",
+    "application/vnd.ms-excel": ".xls",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": ".xlsx",
+    "application/json": ".json",
+}
+
+JSON_MEDIA_TYPE = "application/json"
+
+# Media types of the streamed DataTable
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": JSON_MEDIA_TYPE,
+}
+
+# body: bytes, a buffer (e.g. pyarrow Buffer) or an iterator of chunks for a streamed response
+Result = collections.namedtuple("Result", ["body", "media_type"])
+
+
+@timed("serialization")
+def serialized(value):
+    """dumps(value), timed as the serialization stage of the request (see metrics)."""
+    return dumps(value)
+
+
+@timed("serialization")
+def serialized_chunks(chunks):
+    """The JSON text of an iterator of str chunks as bytes, timed as the serialization stage."""
+    return "".join(chunks).encode()
+
+
+def json_result(value):
+    return Result(serialized(value), JSON_MEDIA_TYPE)
+
+
+@timed("detect_type")
+def detect_extension(byte_data):
+    """
+    The extension of the content of a file: Parquet, Arrow IPC and .npy files by their magic number,
+    the other files with python-magic.
+    """
+    extension = columnar_file_format(byte_data[:8])
+    if extension is not None:
+        logger.info(f"File extension determined as: {extension}")
+        return extension
+    file_type = magic.from_buffer(byte_data, mime=True)
+    logger.info(f"Detected file type: {file_type}")
+    extension = EXTENSION_MAP.get(file_type, ".csv")
+    logger.info(f"File extension determined as: {extension}")
+    return extension
+
+
+def open_data_file(byte_data, file_format=None, name=None):
+    """
+    data_file of the content of a file (bytes, or a SpooledBody which is read here in the worker).
+    file_format: the extension of the file, None to detect it with python-magic.
+    """
+    if isinstance(byte_data, SpooledBody):
+        byte_data = byte_data.read()
+    label(file_size=len(byte_data))
+    if file_format is None:
+        file_format = detect_extension(byte_data)
+    return data_file(byte_data, file_format=file_format, name=name)
+
+
+def is_cyclic(new_file):
+    """True if the file is a cyclic temperature file (343 numeric columns)."""
+    same_col_dict = new_file.find_type_and_keyword()
+    log_payload(logger, "same_col_dict contents", same_col_dict)
+    no_col = list(same_col_dict.keys())[1]
+    logger.info(f"Column type detected: {no_col}")
+    return no_col == 343
+
+
+def data_table(byte_data, file_format=None, table_format=None):
+    """
+    The DataTable of a file as JSON, or as Arrow IPC stream / Parquet file if table_format is "arrow" / "parquet".
+    file_format: ".txt" for the txt routes, None to detect the format with python-magic and to give
+    343-column files as cyclic temperature files (the csv routes).
+    """
+    new_file = open_data_file(byte_data, file_format)
+    logger.info("Starting data validation and processing.")
+
+    if file_format is None and is_cyclic(new_file):
+        logger.info("Processing data as cyclic temperature file.")
+        cyclic_temp_file = new_file.cyclic_temp_processor
+        if table_format:
+            try:
+                matrix = cyclic_temp_file.table_matrix_temp()
+            except ValueError as e:
+                return json_result({"Error": str(e)})
+            logger.info(f"Returning the DataTable as {table_format}.")
+            return _binary_table(matrix.columns_dict(), table_format)
+        table = cyclic_temp_file.table_of_df_temp()
+    else:
+        logger.info("Processing data as general file.")
+        if table_format:
+            logger.info(f"Returning the DataTable as {table_format}.")
+            return _binary_table(new_file.table_frame(), table_format)
+        table = new_file.table_of_df()
+
+    logger.info("Data processing completed successfully.")
+    return json_result(table)
+
+
+@timed("serialization")
+def _binary_table(columns, table_format):
+    table = arrow_table(columns)
+    if table_format == "arrow":
+        return Result(to_arrow_ipc(table), ARROW_STREAM_MEDIA_TYPE)
+    return Result(to_parquet(table), PARQUET_MEDIA_TYPE)
+
+
+def data_table_stream(byte_data, file_format=None, stream_format="ndjson"):
+    """
+    The DataTable of a file as iterator of NDJSON lines ("ndjson") or of the chunks of the JSON document ("json"),
+    the rows are encoded only when they are read. Errors of a cyclic temperature file are returned as JSON body.
+    file_format as for data_table.
+    """
+    new_file = open_data_file(byte_data, file_format)
+    logger.info("Starting data validation and processing.")
+
+    if file_format is None and is_cyclic(new_file):
+        logger.info("Processing data as cyclic temperature file.")
+        try:
+            rows = new_file.cyclic_temp_processor.iter_table_of_df_temp()
+        except ValueError as e:
+            return json_result({"Error": str(e)})
+    else:
+        logger.info("Processing data as general file.")
+        rows = new_file.iter_table_of_df()
+
+    logger.info(f"Streaming the DataTable as {stream_format}.")
+    if stream_format == "ndjson":
+        chunks = iter_ndjson(rows)
+    else:
+        chunks = iter_json_document(rows, "DataTable")
+    return Result(chunks, STREAM_MEDIA_TYPES[stream_format])
+
+
+def database_values(byte_data, file_format=None):
+    """
+    The compositions of the resistance of each MA for the database (info_R_in_MA_for_database).
+    file_format as for data_table. For cyclic temperature files the JSON text is written directly from the columns.
+    """
+    new_file = open_data_file(byte_data, file_format)
+    logger.info("Starting data validation and processing.")
+
+    if file_format is None and is_cyclic(new_file):
+        logger.info("Processing data as cyclic temperature file.")
+        json_chunks = new_file.cyclic_temp_processor.stream_info_R_in_MA_for_database_temp()
+        body = serialized_chunks(json_chunks)
+        logger.info("Data processing completed successfully.")
+        logger.info(f"Response JSON of the cyclic temperature file: {len(body)} bytes")
+        return Result(body, JSON_MEDIA_TYPE)
+
+    logger.info("Processing data as general file.")
+    rMin_rMax_MA_values = new_file.info_R_in_MA_for_database()
+    logger.info("Data processing completed successfully.")
+    if file_format is None:
+        log_payload(logger, "Response JSON", rMin_rMax_MA_values)
+    return json_result(rMin_rMax_MA_values)
+
+
+def overall_values(byte_data, file_format=None):
+    """The overall minimum and maximum resistance for the database (info_for_database). file_format as for data_table."""
+    new_file = open_data_file(byte_data, file_format)
+    if file_format is None and is_cyclic(new_file):
+        return json_result(new_file.cyclic_temp_processor.info_for_database_temp())
+    return json_result(new_file.info_for_database())
+
+
+def validation(byte_data, file_format=None, name=None):
+    """
+    The validation status of a file (file_validation).
+    file_format: the extension of the file, None to detect it with python-magic. name: the file name, if it is known.
+    """
+    new_file = open_data_file(byte_data, file_format, name)
+    return json_result(new_file.file_validation())
+
+
+# Outputs of analyze, in the order in which they are given
+ANALYZE_OUTPUTS = ("validation", "table", "database", "overall")
+
+
+def analyze(byte_data, file_format=None, outputs=ANALYZE_OUTPUTS, name=None, detect_cyclic=None, progress=None):
+    """
+    Several outputs of a file from one parse, as JSON {output: value}:
+        "validation" --> file_validation()
+        "table" --> table_of_df() / table_of_df_temp()
+        "database" --> info_R_in_MA_for_database() / info_R_in_MA_for_database_temp()
+        "overall" --> info_for_database() / info_for_database_temp()
+    All outputs use the same data_file, so the file is read, sniffed and loaded only once and the intermediate
+    DataFrames are shared. file_format as for data_table, 343-column files are handled as cyclic temperature files.
+    name: the file name, if it is known. detect_cyclic: whether 343-column files are cyclic temperature files,
+    by default only if file_format is None (as in the csv routes).
+    An output that fails is given as {"Error": ...}, the other outputs are still computed.
+    progress(output, done, total) is called before each output is computed, e.g. to report the stage of a job.
+    """
+    if detect_cyclic is None:
+        detect_cyclic = file_format is None
+    new_file = open_data_file(byte_data, file_format, name)
+    logger.info(f"Starting analysis of the file: {', '.join(outputs)}")
+    cyclic = False
+    if detect_cyclic:
+        try:
+            cyclic = is_cyclic(new_file)
+        except Exception as e:
+            logger.error(f"Error during `find_type_and_keyword`: {str(e)}", exc_info=True)
+    cyclic_temp_file = new_file.cyclic_temp_processor
+
+    if cyclic:
+        logger.info("Processing data as cyclic temperature file.")
+        producers = {
+            "validation": lambda: serialized(new_file.file_validation()),
+            "table": lambda: serialized(cyclic_temp_file.table_of_df_temp()),
+            # the JSON text of the compositions is written directly from the columns
+            "database": lambda: serialized_chunks(cyclic_temp_file.stream_info_R_in_MA_for_database_temp()),
+            "overall": lambda: serialized(cyclic_temp_file.info_for_database_temp()),
+        }
+    else:
+        logger.info("Processing data as general file.")
+        producers = {
+            "validation": lambda: serialized(new_file.file_validation()),
+            "table": lambda: serialized(new_file.table_of_df()),
+            "database": lambda: serialized(new_file.info_R_in_MA_for_database()),
+            "overall": lambda: serialized(new_file.info_for_database()),
+        }
+
+    parts = []
+    for done, output in enumerate(outputs):
+        if progress is not None:
+            progress(output, done, len(outputs))
+        try:
+            value = producers[output]()
+        except Exception as e:
+            logger.error(f"Error during `{output}`: {str(e)}", exc_info=True)
+            value = serialized({"Error": f"Failed to compute {output}: {str(e)}"})
+        parts.append(dumps(output) + b":" + value)
+
+    logger.info("Data processing completed successfully.")
+    return Result(b"{" + b",".join(parts) + b"}", JSON_MEDIA_TYPE)
+
+
+# Extensions of the members of a zip archive that are processed by the batch route
+BATCH_FILE_FORMATS = (".csv", ".txt", ".xlsx") + COLUMNAR_FILE_FORMATS
+# Formats whose files with 343 columns are cyclic temperature files
+CYCLIC_FILE_FORMATS = (".csv", ".xlsx") + COLUMNAR_FILE_FORMATS
+
+
+def archive_members(archive, max_bytes=MAX_BODY_BYTES):
+    """
+    The names of the measurement files in a zipfile.ZipFile (also in per-library folders) and the names of
+    the other members that are skipped: folders, hidden files (e.g. __MACOSX/), other extensions and
+    members that unpack to more than max_bytes (the largest request body), which guards against zip bombs.
+    """
+    members = []
+    skipped = []
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        parts = info.filename.split("/")
+        if any(part.startswith(".") or part == "__MACOSX" for part in parts):
+            skipped.append(info.filename)
+        elif os.path.splitext(info.filename)[1].lower() not in BATCH_FILE_FORMATS:
+            skipped.append(info.filename)
+        elif info.file_size > max_bytes:
+            logger.warning(f"Archive member {info.filename} is skipped, it unpacks to {info.file_size} bytes")
+            skipped.append(info.filename)
+        else:
+            members.append(info.filename)
+    return members, skipped
+
+
+def read_member(archive, member, max_bytes=MAX_BODY_BYTES):
+    """
+    The content of a member of a zipfile.ZipFile. At most max_bytes + 1 bytes are decompressed, so a member
+    whose header gives a smaller size than it unpacks to can not exceed the limit either; it raises BodyTooLarge.
+    """
+    with archive.open(member) as f:
+        byte_data = f.read(max_bytes + 1)
+    if len(byte_data) > max_bytes:
+        raise BodyTooLarge(f"{member} unpacks to more than {max_bytes} bytes")
+    return byte_data
+
+
+def analyze_member(byte_data, member, outputs=ANALYZE_OUTPUTS):
+    """
+    analyze() of a member of a zip archive. The format is the extension of the member name, csv, xlsx and
+    columnar files with 343 columns are cyclic temperature files. The member name (with its folders) is the file name,
+    so file_temperature() sees the folder of the library.
+    """
+    file_format = os.path.splitext(member)[1].lower()
+    try:
+        return analyze(byte_data, file_format, outputs, name=member, detect_cyclic=file_format in CYCLIC_FILE_FORMATS)
+    except Exception as e:
+        logger.error(f"Error during analysis of {member}: {str(e)}", exc_info=True)
+        return json_result({"Error": f"Failed to analyze {member}: {str(e)}"})
+
+
+def log_to_server(log_queue, payload_sample_rate, payload_max_bytes):
+    """
+    Sends the log records of a worker process to the log queue of the server, which writes them to its
+    log file (see structured_logging), and sets the sampling of the logged payloads.
+    """
+    log_to_queue(logger, log_queue)
+    set_payload_sampling(payload_sample_rate, payload_max_bytes)
@@ -0,0 +1,98 @@
+import asyncio
+import collections
+import time
+
+
+class ResultCache:
+    """
+    In-process LRU cache of computed results, bounded by the number of entries, their total size in bytes
+    and the time to live of each entry. The least recently used entries are evicted first.
+
+    get_or_compute() collapses concurrent computations of the same key (single-flight): while one request
+    computes a result, the other requests with the same key wait for it instead of computing it again.
+    The cache is used from one event loop, it is not protected by a lock.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl=600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self._entries = collections.OrderedDict()  # key --> (expires at, size, value)
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """The value stored under key, None if there is none or it has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value, size):
+        """Stores value under key. Values larger than max_bytes are not stored."""
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        self._entries[key] = (self.clock() + self.ttl, size, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+    async def get_or_compute(self, key, compute, size_of):
+        """
+        The value stored under key, or the value of await compute() which is then stored.
+        size_of(value) gives the size of a value in bytes, or None if the value can not be stored and not be
+        shared with other requests (e.g. a response that streams its content); waiting requests then compute
+        their own value. An exception of compute() is raised in all requests that waited for it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            value = await asyncio.shield(future)
+            if value is not None:
+                return value
+            return await compute()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # the exception is retrieved, also if no other request waits for it
+            raise
+        except BaseException:
+            # e.g. the request was cancelled, the waiting requests compute their own value
+            future.set_result(None)
+            raise
+        finally:
+            del self._inflight[key]
+
+        size = size_of(value)
+        if size is None:
+            future.set_result(None)
+        else:
+            self.put(key, value, size)
+            future.set_result(value)
+        return value
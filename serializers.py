@@ -0,0 +1,163 @@
+import itertools
+import json
+
+import math
+
+import numpy as np
+import pandas as pd
+
+# orjson writes dictionaries, numpy scalars and numpy arrays many times faster than json. It is used if it is
+# installed, otherwise the values are converted to native Python values and written with json.
+try:
+    import orjson
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+except ImportError:
+    orjson = None
+
+# pyarrow is only needed to give tables as Arrow IPC stream or Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# Number of rows which are converted to Python values in one step by iter_records
+RECORDS_CHUNK_ROWS = 4096
+
+
+def native_values(values):
+    """
+    A numpy array as (nested) list of native Python values (int, float, str, bool, ...),
+    converted in bulk with tolist(), a 2D array gives one list per row.
+    Missing values (NaN, None, pd.NA, NaT) become None, so the values can be written as JSON without NaN.
+    numpy scalars inside object arrays are converted with item().
+    """
+    if values.dtype == object:
+        values = _item_of_numpy_scalars(values)
+        mask = pd.isna(values)
+    elif values.dtype.kind in 'fc':
+        mask = np.isnan(values)
+    elif values.dtype.kind in 'mM':
+        mask = np.isnat(values)
+    else:
+        mask = None
+    if mask is not None and mask.any():
+        values = values.astype(object)
+        values[mask] = None
+    return values.tolist()
+
+
+_item_of_numpy_scalars = np.frompyfunc(lambda value: value.item() if isinstance(value, np.generic) else value, 1, 1)
+
+
+def iter_records(df, columns=None, chunk_rows=RECORDS_CHUNK_ROWS):
+    """
+    One dictionary column name --> native Python value for each row of the DataFrame.
+    The DataFrame is converted column-wise into one array with the common dtype of its columns
+    (a row with int and float columns has only floats, as df.iloc[i] has) and then chunk by chunk into Python values.
+    columns replaces the column names of df in the dictionaries.
+    """
+    keys = list(df.columns) if columns is None else list(columns)
+    if len(keys) != df.shape[1]:
+        raise ValueError(f"Expected {df.shape[1]} column names, got {len(keys)}")
+    values = df.to_numpy()
+    for start in range(0, len(values), chunk_rows):
+        for row in native_values(values[start:start + chunk_rows]):
+            yield dict(zip(keys, row))
+
+
+def dumps(value):
+    """
+    The compact JSON text of a value as UTF-8 bytes. Besides the JSON types numpy scalars and numpy arrays
+    are written natively, keys of dictionaries that are not strings are written as strings.
+    NaN and infinite floats are written as null, which is valid JSON, instead of failing.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=ORJSON_OPTIONS)
+    return json.dumps(_jsonable(value), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def _json_default(value):
+    ## types that orjson does not write itself: numpy arrays that are not contiguous or have an object dtype, pd.NA
+    if isinstance(value, np.ndarray):
+        return native_values(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA:
+        return None
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _jsonable(value):
+    ## the value with native Python values only and None for NaN and infinite floats, for json.dumps
+    if isinstance(value, dict):
+        return {key if isinstance(key, str) else _jsonable_key(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, (str, int, bool)) or value is None:
+        return value
+    return _jsonable(_json_default(value))
+
+
+def _jsonable_key(key):
+    key = _jsonable(key)
+    if isinstance(key, bool) or key is None:
+        return json.dumps(key)
+    return str(key)
+
+
+def iter_ndjson(rows, rows_per_chunk=128):
+    """The rows as NDJSON text (one JSON document per line), rows_per_chunk lines in each chunk."""
+    for chunk in _chunks(rows, rows_per_chunk):
+        yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+
+def iter_json_document(rows, key, rows_per_chunk=128):
+    """The JSON text of {key: [rows]} written incrementally, rows_per_chunk rows in each chunk."""
+    yield b"{" + dumps(key) + b":["
+    separator = b""
+    for chunk in _chunks(rows, rows_per_chunk):
+        yield separator + b",".join(dumps(row) for row in chunk)
+        separator = b","
+    yield b"]}"
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def arrow_table(columns):
+    """
+    pyarrow Table of a DataFrame or of a dictionary column name --> 1D numpy array, with the dtypes of the columns.
+    Contiguous numeric arrays are not copied, NaN is given as null as in pandas.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required for Arrow and Parquet output")
+    if isinstance(columns, pd.DataFrame):
+        return pa.Table.from_pandas(columns, preserve_index=False)
+    return pa.table({str(name): pa.array(values, from_pandas=True) for name, values in columns.items()})
+
+
+def to_arrow_ipc(table):
+    """The table in the Arrow IPC stream format, as pyarrow Buffer (memoryview(buffer) gives the bytes without a copy)."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def to_parquet(table):
+    """The table as Parquet file, as pyarrow Buffer (memoryview(buffer) gives the bytes without a copy)."""
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue()
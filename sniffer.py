@@ -0,0 +1,158 @@
+import functools
+import itertools
+import re
+
+import numbers
+
+import numpy as np
+import pandas as pd
+
+# A token is numeric if float() accepts it, which is exactly what this pattern matches
+# (surrounding whitespace, sign, digits with "_" separators, exponent, inf/infinity and nan).
+_DIGITS = r"\d(?:_?\d)*"
+NUMERIC_TOKEN = re.compile(
+    r"\s*[+-]?(?:(?:{d}(?:\.(?:{d})?)?|\.{d})(?:e[+-]?{d})?|inf(?:inity)?|nan)\s*".format(d=_DIGITS),
+    re.IGNORECASE,
+)
+
+# Number of lines which are classified in one vectorized pass, the batch is doubled after each pass.
+FIRST_BATCH_LINES = 256
+
+
+@functools.lru_cache(maxsize=None)
+def keyword_matcher(keywords):
+    """
+    One compiled pattern for all keywords. The lookahead finds every position where a keyword starts,
+    at each position the longest keyword is taken (keywords are tried from the longest to the shortest).
+    Every shorter keyword that starts at the same position is a prefix of the found one,
+    therefore the keywords of a line are all keywords that are contained in one of the found words.
+
+    Returns:
+        the compiled pattern and a dictionary: found word --> bit mask of the keywords contained in it
+    """
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    pattern = re.compile("(?=({}))".format("|".join(re.escape(word) for word in ordered)))
+    masks = {}
+    for found in ordered:
+        masks[found] = sum(1 << i for i, word in enumerate(keywords) if word in found)
+    return pattern, masks
+
+
+def count_keywords(lines, keywords):
+    """
+    Number of (line, keyword) pairs where the keyword occurs in the line,
+    i.e. sum(word in line for line in lines for word in keywords), found with one pattern over all lines.
+    """
+    pattern, masks = keyword_matcher(tuple(keywords))
+    text = "\n".join(lines)
+    matches = [(match.start(), match.group(1)) for match in pattern.finditer(text)]
+    if not matches:
+        return 0
+    line_starts = np.cumsum([0] + [len(line) + 1 for line in lines[:-1]])
+    line_nos = np.searchsorted(line_starts, [start for start, _ in matches], side="right") - 1
+    line_masks = {}
+    for line_no, (_, found) in zip(line_nos.tolist(), matches):
+        line_masks[line_no] = line_masks.get(line_no, 0) | masks[found]
+    return sum(bin(mask).count("1") for mask in line_masks.values())
+
+
+def count_numeric_tokens(lines, delimiter=None):
+    """
+    Number of numeric tokens in each line. The lines are split by the delimiter (whitespace if None),
+    all tokens of all lines are classified with NUMERIC_TOKEN in one pass and counted per line.
+    For whitespace separated lines a decimal comma is accepted, as in "1,5".
+    """
+    if delimiter is None:
+        rows = [line.replace(",", ".").split() for line in lines]
+    else:
+        rows = [line.split(delimiter) for line in lines]
+    lengths = np.fromiter(map(len, rows), dtype=np.intp, count=len(rows))
+    tokens = list(itertools.chain.from_iterable(rows))
+    is_numeric = np.fromiter(map(bool, map(NUMERIC_TOKEN.fullmatch, tokens)), dtype=bool, count=len(tokens))
+    line_ids = np.repeat(np.arange(len(rows)), lengths)
+    return np.bincount(line_ids, weights=is_numeric, minlength=len(rows)).astype(np.intp)
+
+
+def count_numeric_cells(df):
+    """
+    Number of floatable cells in each row of a DataFrame, empty cells are not counted.
+    Columns with a numeric dtype are counted with notna, only cells of object columns are checked one by one:
+    numbers and strings that float() accepts are floatable.
+    """
+    counts = np.zeros(len(df), dtype=np.intp)
+    for _, column in df.items():
+        if pd.api.types.is_numeric_dtype(column.dtype):
+            counts += column.notna().to_numpy()
+        else:
+            counts += np.fromiter(map(_is_floatable_cell, column.to_numpy()), dtype=bool, count=len(column))
+    return counts
+
+
+def _is_floatable_cell(value):
+    if isinstance(value, str):
+        return NUMERIC_TOKEN.fullmatch(value) is not None
+    return isinstance(value, numbers.Number) and not pd.isna(value)
+
+
+def _same_col_dict(count_keyword, float_list, min_repeats):
+    same_col_dict = {"keyword": count_keyword}
+    repeats = {}
+    for i in float_list:
+        repeats[i] = repeats.get(i, 0) + 1
+    for i, count_val_float in repeats.items():
+        if count_val_float > min_repeats:
+            same_col_dict[i] = count_val_float
+    return same_col_dict
+
+
+def sniff_frame(df, keywords, max_float_lines=100, min_repeats=5):
+    """
+    The same dictionary as sniff_text for a table that is already loaded, e.g. an .xlsx sheet.
+    A keyword is counted once if it is a column name and once for every row that has a cell equal to it.
+    The number of floatable cells is counted for the rows until more than max_float_lines rows
+    with at least two floatable cells were found.
+    """
+    counts = count_numeric_cells(df)
+    float_list = counts[counts > 1][:max_float_lines + 1].tolist()
+
+    count_keyword = sum(1 for word in keywords if word in df.columns)
+    text_columns = [name for name, column in df.items() if not pd.api.types.is_numeric_dtype(column.dtype)]
+    if text_columns:
+        values = df[text_columns].to_numpy(dtype=object)
+        for word in keywords:
+            count_keyword += int((values == word).any(axis=1).sum())
+    return _same_col_dict(count_keyword, float_list, min_repeats)
+
+
+def sniff_text(text, delimiter, keywords, max_float_lines=100, min_repeats=5):
+    """
+    Goal: finding keywords and the number of numeric columns of the measurement table in a text.
+    Lines are read until more than max_float_lines lines with at least two numeric tokens were found.
+
+    Returns the dictionary of data_file.find_type_and_keyword:
+        "keyword" --> number of keywords found in the read lines
+        number of numeric columns --> number of lines with that many numeric columns,
+        for all numbers that are repeated more than min_repeats times, in the order of their first appearance
+    """
+    lines = text.split("\n")
+    float_list = []
+    count_keyword = 0
+    start = 0
+    batch = FIRST_BATCH_LINES
+    while start < len(lines):
+        block = lines[start:start + batch]
+        counts = count_numeric_tokens(block, delimiter)
+        float_rows = np.flatnonzero(counts > 1)
+        needed = max_float_lines + 1 - len(float_list)
+        if len(float_rows) >= needed:
+            # the line which completes the float list is the last line that is read
+            block = block[:float_rows[needed - 1] + 1]
+            float_rows = float_rows[:needed]
+        float_list.extend(counts[float_rows].tolist())
+        count_keyword += count_keywords(block, keywords)
+        if len(float_list) > max_float_lines:
+            break
+        start += batch
+        batch *= 2
+
+    return _same_col_dict(count_keyword, float_list, min_repeats)
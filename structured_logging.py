@@ -0,0 +1,159 @@
+"""
+Logging of the web service that does not write on the event loop or in the workers.
+
+The loggers only put their records into a queue (QueueHandler); a listener thread of the server process
+takes them out and writes them to the log file, one JSON object per line:
+    {"time": ..., "level": ..., "logger": ..., "message": ..., "process": ..., "thread": ..., "location": ...,
+     "exception": ... (traceback, if any), and the fields given with extra={...}}
+The worker processes put their records into the same multiprocessing queue, so all lines end up in one file.
+The log file is rotated when it is larger than max_bytes or older than rotate_seconds.
+
+Payloads (e.g. a response) are only logged with log_payload(): a record is written for a sample of the calls
+(sample_rate) and holds at most max_bytes of the compact JSON text of the payload.
+"""
+import datetime as dt
+import logging
+import logging.handlers
+import random
+import threading
+import time
+
+from serializers import dumps
+
+# Size and age after which the log file is rotated, and the number of rotated files that are kept
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_ROTATE_SECONDS = 24 * 3600
+LOG_BACKUP_COUNT = 10
+# Share of the calls of log_payload() that write the payload and the largest part of a payload that is written
+PAYLOAD_SAMPLE_RATE = 0.01
+PAYLOAD_MAX_BYTES = 16 * 1024
+
+# Attributes of every LogRecord, the other attributes are the fields given with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON with its extra fields."""
+
+    def format(self, record):
+        entry = {
+            "time": dt.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+            "location": f"{record.module}:{record.lineno}",
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        try:
+            return dumps(entry).decode()
+        except TypeError:
+            ## extra fields that are not JSON types are written as their repr()
+            return dumps({key: value if key in ("time", "level", "logger", "message", "process", "thread",
+                                                "location", "exception", "stack") else repr(value)
+                          for key, value in entry.items()}).decode()
+
+
+class RotatingJsonFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rotates the file every rotate_seconds, the rotated files are
+    numbered (.1 is the newest) and backup_count of them are kept.
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, rotate_seconds=LOG_ROTATE_SECONDS,
+                 backup_count=LOG_BACKUP_COUNT, encoding="utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.rotate_seconds = rotate_seconds
+        self.rollover_at = time.time() + rotate_seconds
+        self.setFormatter(JsonFormatter())
+
+    def shouldRollover(self, record):
+        if self.rotate_seconds and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotate_seconds
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps the extra fields of a record and its traceback as text, so the record can
+    be sent to another process and formatted there by JsonFormatter.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class QueueLogging:
+    """
+    The listener that writes the records of a queue with handler. start() and stop() can be called
+    again, stop() writes the records that are still in the queue.
+    """
+
+    def __init__(self, queue, handler):
+        self.queue = queue
+        self.handler = handler
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+                self._listener.start()
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None:
+                self._listener.stop()
+                self._listener = None
+                self.handler.flush()
+
+
+def log_to_queue(logger, queue, level=logging.INFO):
+    """Sends the records of logger to queue, if it has no handler yet (e.g. in a worker process)."""
+    if not logger.handlers:
+        logger.addHandler(StructuredQueueHandler(queue))
+        logger.setLevel(level)
+
+
+_payload_sampling = {"sample_rate": PAYLOAD_SAMPLE_RATE, "max_bytes": PAYLOAD_MAX_BYTES}
+
+
+def set_payload_sampling(sample_rate=PAYLOAD_SAMPLE_RATE, max_bytes=PAYLOAD_MAX_BYTES):
+    """Sets the share of the calls of log_payload() that write the payload and the size cap of the payload."""
+    _payload_sampling["sample_rate"] = sample_rate
+    _payload_sampling["max_bytes"] = max_bytes
+
+
+def log_payload(logger, message, payload, level=logging.INFO):
+    """
+    Logs message with the compact JSON text of payload as field "payload" for a sample of the calls,
+    cut after max_bytes; "payload_bytes" is the size of the whole text and "payload_truncated" tells whether it was cut.
+    The payload is only serialized for the sampled calls.
+    """
+    if not logger.isEnabledFor(level) or random.random() >= _payload_sampling["sample_rate"]:
+        return
+    text = dumps(payload)
+    max_bytes = _payload_sampling["max_bytes"]
+    logger.log(level, message, extra={
+        "payload": text[:max_bytes].decode(errors="ignore"),
+        "payload_bytes": len(text),
+        "payload_truncated": len(text) > max_bytes,
+    })
@@ -0,0 +1,140 @@
+import io
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# pyarrow is only needed to read Parquet and Arrow IPC files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Binary formats that already hold the table with typed columns, they are loaded without a text parse
+COLUMNAR_FILE_FORMATS = ('.parquet', '.arrow', '.npy')
+
+# Magic numbers of the columnar formats: Parquet, Arrow IPC file, Arrow IPC stream (continuation marker), NumPy
+COLUMNAR_MAGIC = (
+    (b'PAR1', '.parquet'),
+    (b'ARROW1', '.arrow'),
+    (b'\xff\xff\xff\xff', '.arrow'),
+    (b'\x93NUMPY', '.npy'),
+)
+
+# Column names of a plain 2D array with 343 columns: the resistance matrix of the cyclic temperature files
+CYCLIC_MATRIX_COLUMNS = ['T'] + [f"MA{i:03d}" for i in range(1, 343)]
+
+
+class TableParseError(ValueError):
+    """
+    Raised when rows of a measurement table do not fit the column names or contain values that are not numeric.
+    bad_rows is a list of (line number, line) of the rows that could not be read, line numbers start at 1.
+    """
+
+    def __init__(self, message, bad_rows):
+        self.bad_rows = bad_rows
+        shown = ", ".join(str(line_no) for line_no, _ in bad_rows[:10])
+        if len(bad_rows) > 10:
+            shown += f", ... ({len(bad_rows)} rows)"
+        super().__init__(f"{message} (lines: {shown})")
+
+
+def read_numeric_table(text, column_name, delimiter=None):
+    """
+    Reads the table of measurement of a text file in one bulk step instead of appending the rows one by one.
+    The lines are split by the delimiter (whitespace if None), lines with less than two values are skipped.
+    For whitespace separated files a decimal comma is replaced by a dot, so "1,5" is read as 1.5.
+    Every column is converted with pd.to_numeric, the rows keep the numbers 1, 2, 3, ... as index.
+
+    Raises TableParseError with the bad rows if a row has another number of values than column_name
+    or if a value is not numeric.
+    """
+    if delimiter is None:
+        text = text.replace(',', '.')
+    lines = text.split('\n')
+    rows = [line.split(delimiter) for line in lines]
+    kept = [i for i, col in enumerate(rows) if len(col) > 1]
+
+    no_col = len(column_name)
+    bad_rows = [(i + 1, lines[i]) for i in kept if len(rows[i]) != no_col]
+    if bad_rows:
+        raise TableParseError(f"Rows do not have {no_col} columns", bad_rows)
+
+    if not kept:
+        return pd.DataFrame(columns=list(column_name))
+
+    values = np.array(list(itertools.chain.from_iterable(rows[i] for i in kept)), dtype=object)
+    values = values.reshape(len(kept), no_col)
+    index = pd.RangeIndex(1, len(kept) + 1)
+
+    columns = {}
+    bad_cells = np.zeros(len(kept), dtype=bool)
+    for j in range(no_col):
+        column = pd.Series(values[:, j], index=index, dtype=object)
+        try:
+            columns[j] = pd.to_numeric(column)
+        except (ValueError, TypeError):
+            bad_cells |= np.array([not _is_numeric(value) for value in values[:, j]], dtype=bool)
+    if bad_cells.any():
+        bad_rows = [(kept[i] + 1, lines[kept[i]]) for i in np.flatnonzero(bad_cells)]
+        raise TableParseError("Rows contain values that are not numeric", bad_rows)
+
+    df = pd.DataFrame(columns, index=index)
+    df.columns = list(column_name)
+    return df
+
+
+def _is_numeric(value):
+    try:
+        pd.to_numeric(pd.Series([value], dtype=object))
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+def columnar_file_format(prefix):
+    """The columnar format (".parquet", ".arrow", ".npy") of a file that starts with prefix, None for other files."""
+    for magic, file_format in COLUMNAR_MAGIC:
+        if prefix.startswith(magic):
+            return file_format
+    return None
+
+
+def read_columnar_table(raw, file_format):
+    """
+    Loads the table of a Parquet file, an Arrow IPC file or stream (".arrow") or a NumPy .npy file as DataFrame
+    with the column names and dtypes of the file.
+    A structured .npy array gives one column per field. A plain 2D array has no column names: with 343 columns
+    it is the resistance matrix T, MA001, ..., MA342 of the cyclic temperature files (with integer temperatures
+    if they are all whole numbers, as read_csv reads them), otherwise its columns are numbered as the columns
+    of a text file without header.
+    """
+    if file_format == '.npy':
+        values = np.load(io.BytesIO(raw), allow_pickle=False)
+        if values.dtype.names:
+            return pd.DataFrame(values.reshape(-1))
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        if values.ndim != 2:
+            raise ValueError(f"Expected a 1D or 2D array, got {values.ndim} dimensions")
+        if values.shape[1] != len(CYCLIC_MATRIX_COLUMNS):
+            return pd.DataFrame(values)
+        df = pd.DataFrame(values, columns=CYCLIC_MATRIX_COLUMNS)
+        temperature = df['T'].to_numpy()
+        if temperature.dtype.kind == 'f' and np.isfinite(temperature).all() and (temperature == np.round(temperature)).all():
+            df['T'] = temperature.astype(np.int64)
+        return df
+
+    if pa is None:
+        raise ValueError("pyarrow is required to read Parquet and Arrow files")
+    if file_format == '.parquet':
+        table = pq.read_table(pa.BufferReader(raw))
+    elif file_format == '.arrow':
+        if raw.startswith(b'ARROW1'):
+            table = pa.ipc.open_file(pa.BufferReader(raw)).read_all()
+        else:
+            table = pa.ipc.open_stream(pa.BufferReader(raw)).read_all()
+    else:
+        raise ValueError(f"Unsupported columnar file format: {file_format}")
+    return table.to_pandas()